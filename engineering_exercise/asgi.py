@@ -0,0 +1,59 @@
+"""
+ASGI config for engineering_exercise project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+to be served by an ASGI server such as uvicorn:
+
+    uvicorn engineering_exercise.asgi:application
+
+Django 2.1 has no ASGI handler or async views, so the WSGI application is
+adapted here. The server's event loop deals with the sockets, so slow
+clients sending or reading don't hold anything up, and each request runs in
+a thread of the event loop's default executor. Django keeps database
+connections per thread, so requests run side by side just as they do under
+a threaded WSGI server.
+"""
+
+import os
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'engineering_exercise.settings')
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """ Runs the WSGI application for one request in its own worker thread.
+    asgiref would run every request in a single shared thread """
+
+    @sync_to_async(thread_sensitive=False)
+    def run_wsgi_app(self, body):
+        """ Calls the WSGI application and sends on what it returns, closing
+        the response afterwards so that Django's request_finished handlers run """
+        environ = self.build_environ(self.scope, body)
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in response:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi): #pylint: disable=R0903
+    """ WsgiToAsgi running each request in its own worker thread """
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+application = ThreadedWsgiToAsgi(get_wsgi_application()) #pylint: disable=C0103
@@ -0,0 +1,36 @@
+""" Token authentication for the API
+
+Clients send 'Authorization: Token <key>' with the key of an ApiToken.
+Unlike basic authentication there is no slow password hash per request,
+and through fintech.token_cache a request with a recently used token makes
+no queries to authenticate or to check permissions.
+"""
+from rest_framework import authentication, exceptions
+
+from fintech import token_cache
+from fintech.models import ApiToken
+
+
+def _load_token(key_hash):
+    """ The live ApiToken with key_hash, with its active User, or None. The
+    permissions of the User are loaded so that they are cached with it """
+    token = ApiToken.objects.select_related('user').filter(
+        key_hash=key_hash, revoke_time__isnull=True
+    ).first()
+    if token is None or not token.user.is_active:
+        return None
+    # Superusers have every permission without looking them up
+    if not token.user.is_superuser:
+        token.user.get_all_permissions()
+    return token
+
+
+class HashedTokenAuthentication(authentication.TokenAuthentication):
+    """ DRF's token authentication against the hashed keys of ApiTokens """
+
+    def authenticate_credentials(self, key):
+        key_hash = ApiToken.hash_key(key)
+        token = token_cache.get_or_load(key_hash, lambda: _load_token(key_hash))
+        if token is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        return token.user, token
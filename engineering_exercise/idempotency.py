@@ -0,0 +1,93 @@
+""" Idempotency-Key support for POSTs, so that clients can retry them safely
+
+A client sends a key of its choosing in the Idempotency-Key header. The
+first successful response to a POST with the key is stored along with the
+change it made, and a retry with the same key gets the stored response back
+without the change being made again.
+"""
+import hashlib
+import json
+from django.db import IntegrityError
+from rest_framework import serializers, status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from fintech.models import IdempotencyKey, write_atomically
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class _NotStored(Exception):
+    """ Rolls back a POST whose response isn't stored, carrying the response """
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def _request_hash(request):
+    """ Fingerprints the path and parsed body of the request """
+    body = json.dumps(request.data, cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha256('{}\n{}'.format(request.path, body).encode()).hexdigest()
+
+
+def _replay(stored, request_hash):
+    """ The stored response, unless the key was used for a different request """
+    if stored.request_hash != request_hash:
+        return Response(
+            {'detail': 'Idempotency-Key has already been used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(json.loads(stored.response), status=stored.status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(request, account, create):
+    """ Returns create(), the Response to a POST on account, unless the
+    request has an Idempotency-Key header with a live key already used on
+    the account, in which case the response stored for the key is replayed.
+
+    Successful responses are stored in the same database transaction as the
+    writes of create(), so a key is only stored if its POST took effect, and
+    of two concurrent POSTs with one key only the first to commit does """
+    key = request.META.get(HEADER)
+    if key is None:
+        return create()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise serializers.ValidationError({'Idempotency-Key': [
+            'Must be between 1 and {} characters long'.format(MAX_KEY_LENGTH)
+        ]})
+    request_hash = _request_hash(request)
+    live_keys = IdempotencyKey.objects.filter(
+        account=account, key=key, create_time__gte=IdempotencyKey.expiry_cutoff()
+    )
+    stored = live_keys.first()
+    if stored is not None:
+        return _replay(stored, request_hash)
+
+    def write():
+        response = create()
+        if not status.is_success(response.status_code):
+            raise _NotStored(response)
+        # An expired key can be used again
+        IdempotencyKey.objects.filter(
+            account=account, key=key, create_time__lt=IdempotencyKey.expiry_cutoff()
+        ).delete()
+        IdempotencyKey.objects.create(
+            account=account, key=key, request_hash=request_hash,
+            status_code=response.status_code,
+            response=json.dumps(response.data, cls=JSONEncoder),
+        )
+        return response
+    try:
+        return write_atomically(write)
+    except _NotStored as err:
+        return err.response
+    except IntegrityError:
+        # A concurrent POST with the same key got there first
+        stored = live_keys.first()
+        if stored is None:
+            raise
+        return _replay(stored, request_hash)
@@ -0,0 +1,168 @@
+""" Request instrumentation for engineering_exercise
+
+Records the SQL query count, database time, serializer and render time and
+response size of each request. These are sent back in a Server-Timing header
+and aggregated per route into histograms in the in-process `registry`.
+"""
+import bisect
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+DURATION_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS_BYTES = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+_local = threading.local() #pylint: disable=C0103
+
+
+class Histogram:
+    """ Counts observations into buckets by their upper bound """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.bucket_counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """ Adds a value to the histogram """
+        self.bucket_counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        """ The histogram with cumulative bucket counts, keyed by upper bound """
+        buckets, cumulative = {}, 0
+        for bound, bucket_count in zip(self.bounds + ('+Inf',), self.bucket_counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        return {'count': self.count, 'sum': round(self.sum, 3), 'buckets': buckets}
+
+
+class MetricsRegistry:
+    """ Thread safe, in-process store of per route request histograms """
+    METRIC_BUCKETS = {
+        'duration_ms': DURATION_BUCKETS_MS,
+        'db_ms': DURATION_BUCKETS_MS,
+        'serializer_ms': DURATION_BUCKETS_MS,
+        'render_ms': DURATION_BUCKETS_MS,
+        'queries': QUERY_COUNT_BUCKETS,
+        'response_bytes': SIZE_BUCKETS_BYTES,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, values):
+        """ Adds the values ({metric name: value}) for one request to route """
+        with self._lock:
+            histograms = self._routes.get(route)
+            if histograms is None:
+                histograms = self._routes[route] = {
+                    name: Histogram(bounds) for name, bounds in self.METRIC_BUCKETS.items()
+                }
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def snapshot(self):
+        """ All the histograms as {route: {metric name: histogram dict}} """
+        with self._lock:
+            return {
+                route: {name: histogram.as_dict() for name, histogram in histograms.items()}
+                for route, histograms in self._routes.items()
+            }
+
+    def reset(self):
+        """ Forgets everything recorded so far """
+        with self._lock:
+            self._routes = {}
+
+
+registry = MetricsRegistry() #pylint: disable=C0103
+
+
+class RequestMetrics: #pylint: disable=R0903
+    """ What the instrumentation has measured for the current request """
+    __slots__ = ('queries', 'db_seconds', 'timers')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0
+        self.timers = {}
+
+    def execute(self, execute, sql, params, many, context):
+        """ Database execute wrapper counting and timing queries """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+@contextmanager
+def timer(name):
+    """ Adds the time spent in the block to the named timer of the current
+    request. Does nothing outside of a request """
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timers[name] = metrics.timers.get(name, 0) + time.perf_counter() - start
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """ JSONRenderer recording its time in the 'render' timer """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class InstrumentationMiddleware: #pylint: disable=R0903
+    """ Measures each request, adds a Server-Timing header to the response
+    and records the measurements in the registry """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.execute))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        values = {
+            'duration_ms': duration_ms,
+            'db_ms': metrics.db_seconds * 1000,
+            'serializer_ms': metrics.timers.get('serializer', 0) * 1000,
+            'render_ms': metrics.timers.get('render', 0) * 1000,
+            'queries': metrics.queries,
+        }
+        if not response.streaming:
+            values['response_bytes'] = len(response.content)
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur={:.3f};desc="{} queries"'.format(values['db_ms'], metrics.queries),
+            'serializer;dur={:.3f}'.format(values['serializer_ms']),
+            'render;dur={:.3f}'.format(values['render_ms']),
+            'total;dur={:.3f}'.format(duration_ms),
+        ])
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = '{} {}'.format(
+            request.method, resolver_match.view_name if resolver_match else '<unresolved>'
+        )
+        registry.record(route, values)
+        return response
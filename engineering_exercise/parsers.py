@@ -0,0 +1,27 @@
+""" Parsers for engineering_exercise
+
+Request body formats beyond the Django REST framework defaults
+"""
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser): # pylint: disable=R0903
+    """ Parses newline delimited JSON (one JSON value per line) into a list """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as err:
+                raise ParseError('NDJSON parse error on line {} - {}'.format(line_number, err))
+        return items
@@ -0,0 +1,50 @@
+""" Renderers for engineering_exercise
+
+Formats for the streaming exports. Exports write their own
+StreamingHttpResponse, so these renderers are only used for errors
+"""
+import csv
+import io
+import json
+from rest_framework.renderers import BaseRenderer
+
+
+def _cell(value):
+    """ The text of a CSV cell, giving the messages of a list of errors """
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(item) for item in value)
+    return str(value)
+
+
+class CSVRenderer(BaseRenderer): # pylint: disable=R0903
+    """ Renders a dict as a CSV header and row, and a list as a row for
+    each item """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if isinstance(data, dict):
+            writer.writerow(data.keys())
+            writer.writerow(_cell(value) for value in data.values())
+        elif isinstance(data, (list, tuple)):
+            writer.writerows([_cell(item)] for item in data)
+        else:
+            writer.writerow([_cell(data)])
+        return output.getvalue().encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer): # pylint: disable=R0903
+    """ Renders data as a single line of JSON """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(data) + '\n').encode(self.charset)
@@ -0,0 +1,131 @@
+""" Fast, read only serialisation of QuerySet.values() rows
+
+A RowSerializer stands in for a ModelSerializer when listing. Rows are
+fetched with values(), so no model instances are built, and each field is
+converted by a function picked for its serializer field when the
+RowSerializer is compiled rather than through Field.to_representation.
+The output matches the ModelSerializer's, so the rendered JSON is byte for
+byte the same. Fields of types not handled here fall back to their own
+to_representation.
+"""
+import datetime
+import decimal
+from collections import OrderedDict
+from rest_framework import ISO_8601, relations, serializers
+from rest_framework.settings import api_settings
+
+
+def format_datetime(value):
+    """ Formats a datetime the way the REST framework DateTimeField does """
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _decimal_converter(field):
+    """ DecimalField.to_representation, with the quantize arguments worked out once """
+    if field.decimal_places is None or field.localize or \
+            not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        return field.to_representation
+    quantum = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        return '{:f}'.format(value.quantize(quantum, rounding=rounding, context=context))
+    return convert
+
+
+def _datetime_converter(field):
+    """ DateTimeField.to_representation for aware datetimes, with the
+    timezone of the current request worked out once """
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        return format_datetime(value.astimezone(field_timezone))
+    return convert
+
+
+def _converter(field):
+    """ The function turning a database value into the field's representation """
+    # Exact type checks, as subclasses may change to_representation
+    field_type = type(field)
+    if field_type is serializers.UUIDField and field.uuid_format == 'hex_verbose':
+        return str
+    if field_type is relations.PrimaryKeyRelatedField and field.pk_field is None:
+        # values() gives the primary key the field would have looked up
+        return None
+    if field_type is serializers.CharField:
+        return str
+    if field_type is serializers.BooleanField:
+        return bool
+    if field_type is serializers.DateField and \
+            getattr(field, 'format', api_settings.DATE_FORMAT).lower() == ISO_8601:
+        return datetime.date.isoformat
+    if field_type is serializers.DecimalField:
+        return _decimal_converter(field)
+    if field_type is serializers.DateTimeField:
+        return _datetime_converter(field)
+    return field.to_representation
+
+
+class RowSerializer:
+    """ Serialises values() rows as serializer_class would serialise the
+    model instances, for the fields it reads straight from the model """
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._fields = None
+
+    @property
+    def fields(self):
+        """ The readable (name, source) pairs of serializer_class """
+        if self._fields is None:
+            fields = []
+            for name, field in self.serializer_class().fields.items():
+                if field.write_only:
+                    continue
+                if '.' in field.source or field.source == '*':
+                    raise ValueError('{} is not a model field of {}'.format(
+                        name, self.serializer_class.__name__
+                    ))
+                fields.append((name, field))
+            self._fields = fields
+        return self._fields
+
+    @property
+    def sources(self):
+        """ The names to pass to QuerySet.values() """
+        return tuple(field.source for _, field in self.fields)
+
+    def values(self, queryset):
+        """ The queryset as the rows to serialise """
+        return queryset.values(*self.sources)
+
+    def compile(self):
+        """ A function serialising one row. Compiled per request, as
+        datetimes depend on the current timezone """
+        converters = tuple(
+            (name, field.source, _converter(field)) for name, field in self.fields
+        )
+
+        def serialize_row(row):
+            data = OrderedDict()
+            for name, source, convert in converters:
+                value = row[source]
+                data[name] = value if value is None or convert is None else convert(value)
+            return data
+        return serialize_row
+
+    def serialize(self, rows):
+        """ The list of serialised rows """
+        serialize_row = self.compile()
+        return [serialize_row(row) for row in rows]
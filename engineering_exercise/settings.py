@@ -42,11 +42,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'engineering_exercise.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'fintech.audit.AuditContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +84,56 @@ DATABASES = {
     }
 }
 
+# Pragmas run on each new SQLite connection by fintech.connections, e.g.
+# {'journal_mode': 'WAL'}. settings_production sets them for production
+SQLITE_PRAGMAS = {}
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# fintech.balance_cache keeps account balances in BALANCE_CACHE_ALIAS.
+# Local memory is per process; use a shared backend with several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'balances': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'balances',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+BALANCE_CACHE_ALIAS = 'balances'
+
+# fintech.token_cache keeps API tokens and their users, with their
+# permissions, in TOKEN_CACHE_ALIAS. Local memory is per process, so other
+# processes only notice a revoked token or changed permissions once their
+# entry times out
+TOKEN_CACHE_ALIAS = 'tokens'
+
+# How long the response to a POST with an Idempotency-Key header is replayed
+# for. Expired keys are removed by the purge_idempotency_keys command
+IDEMPOTENCY_KEY_TTL_SECONDS = 24 * 60 * 60
+
+# fintech.audit writes its queued entries in batches of up to
+# AUDIT_LOG_BATCH_SIZE, at least every AUDIT_LOG_FLUSH_INTERVAL_SECONDS
+AUDIT_LOG_ENABLED = True
+AUDIT_LOG_BATCH_SIZE = 500
+AUDIT_LOG_FLUSH_INTERVAL_SECONDS = 1
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -125,7 +177,18 @@ STATIC_URL = '/static/'
 # Django REST framework config
 # https://www.django-rest-framework.org/
 REST_FRAMEWORK = {
+    # The first decides the WWW-Authenticate header, and so whether the
+    # unauthenticated get 401 rather than 403
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'engineering_exercise.authentication.HashedTokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissions'
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'engineering_exercise.instrumentation.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
@@ -0,0 +1,122 @@
+"""
+Production settings for engineering_exercise, selected with
+DJANGO_SETTINGS_MODULE=engineering_exercise.settings_production
+
+Everything that differs between deployments comes from the environment:
+
+DJANGO_SECRET_KEY (required), DJANGO_ALLOWED_HOSTS (comma separated)
+DATABASE_ENGINE: sqlite (the default) or postgresql
+DATABASE_NAME, and for PostgreSQL DATABASE_USER, DATABASE_PASSWORD,
+    DATABASE_HOST and DATABASE_PORT
+DATABASE_CONN_MAX_AGE: seconds each worker thread keeps its connection
+    open between requests, rather than reconnecting for every request.
+    Defaults to 600
+SQLite: DATABASE_BUSY_TIMEOUT_SECONDS (default 20), SQLITE_MMAP_SIZE
+    (bytes, default 256MiB)
+PostgreSQL: DATABASE_CONNECT_TIMEOUT_SECONDS (default 5),
+    DATABASE_STATEMENT_TIMEOUT_MS (default 30000, 0 for none) and
+    DATABASE_PGBOUNCER (1 when connecting through PgBouncer in transaction
+    pooling mode)
+BALANCE_CACHE_LOCATION: the shared cache (e.g. memcached's host:port) for
+    fintech.balance_cache, with BALANCE_CACHE_BACKEND naming its Django
+    backend (default python-memcached). Without it the cache is off
+"""
+import os
+from django.core.exceptions import ImproperlyConfigured
+
+from fintech.connections import SQLITE_WAL_PRAGMAS
+from .settings import * #pylint: disable=W0401,W0614
+
+
+def _env_int(name, default):
+    """ The environment variable name as an int, or default if it isn't set """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ImproperlyConfigured('{} must be a whole number, not {!r}'.format(name, value))
+
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured('Set DJANGO_SECRET_KEY for the production settings')
+
+DEBUG = False
+
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
+
+
+# Database
+# https://docs.djangoproject.com/en/2.1/ref/databases/
+# Persistent connections are per thread, so a server opens up to
+# processes x threads of them. Keep that below PostgreSQL's max_connections,
+# or put PgBouncer in front when it can't be.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+CONN_MAX_AGE = _env_int('DATABASE_CONN_MAX_AGE', 600)
+
+if DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': dict(
+            DATABASES['default'],
+            NAME=os.environ.get('DATABASE_NAME', DATABASES['default']['NAME']),
+            CONN_MAX_AGE=CONN_MAX_AGE,
+            OPTIONS={
+                # How long a writer waits for the lock before "database is locked"
+                'timeout': _env_int('DATABASE_BUSY_TIMEOUT_SECONDS', 20),
+            },
+        ),
+    }
+    SQLITE_PRAGMAS = dict(SQLITE_WAL_PRAGMAS, mmap_size=_env_int(
+        'SQLITE_MMAP_SIZE', SQLITE_WAL_PRAGMAS['mmap_size']
+    ))
+elif DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'engineering_exercise'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            # PgBouncer in transaction pooling mode hands each transaction to
+            # any server connection, which breaks server side cursors
+            'DISABLE_SERVER_SIDE_CURSORS': _env_int('DATABASE_PGBOUNCER', 0) == 1,
+            'OPTIONS': {
+                'connect_timeout': _env_int('DATABASE_CONNECT_TIMEOUT_SECONDS', 5),
+                'options': '-c statement_timeout={}'.format(
+                    _env_int('DATABASE_STATEMENT_TIMEOUT_MS', 30000)
+                ),
+                # Notices dead persistent connections, e.g. after a failover
+                'keepalives': 1,
+                'keepalives_idle': 60,
+            },
+        },
+    }
+else:
+    raise ImproperlyConfigured(
+        'DATABASE_ENGINE must be sqlite or postgresql, not {!r}'.format(DATABASE_ENGINE)
+    )
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# A write only invalidates cached balances in the backend it reaches, so
+# with several processes local memory would go on serving old balances
+# everywhere else. Without a shared backend the balance cache is off.
+
+BALANCE_CACHE_LOCATION = os.environ.get('BALANCE_CACHE_LOCATION')
+if BALANCE_CACHE_LOCATION:
+    BALANCE_CACHE = {
+        'BACKEND': os.environ.get(
+            'BALANCE_CACHE_BACKEND', 'django.core.cache.backends.memcached.MemcachedCache'
+        ),
+        'LOCATION': BALANCE_CACHE_LOCATION,
+        'TIMEOUT': CACHES[BALANCE_CACHE_ALIAS]['TIMEOUT'],
+    }
+else:
+    BALANCE_CACHE = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+CACHES = dict(CACHES, **{BALANCE_CACHE_ALIAS: BALANCE_CACHE})
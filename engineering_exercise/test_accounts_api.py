@@ -1,13 +1,20 @@
 """ Tests the functionality concerning how engineering_exercise interacts with Accounts objects
 """
 import copy
+import csv
+import json
 import datetime
+import uuid
 from decimal import Decimal
+from unittest import mock
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from fintech.models import Account, Transaction
+from .views import AccountViewSet
 
 
 TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
@@ -61,6 +68,67 @@ class AccountViewsTestCase(TestCase):
         expected_response = Decimal('5.00')
         self.assertEqual(response.json(), expected_response)
 
+    def test_account_balance_after_post(self):
+        """ A cached balance should never outlive a write """
+        account = Account.objects.first()
+        balance_url = reverse('account-balance', args=(account.uuid,))
+        transactions_url = reverse('account-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        today = datetime.datetime.today().date()
+        for _ in range(2):
+            self.assertEqual(self.client.get(balance_url).json(), Decimal('5.00'))
+            self.assertEqual(
+                self.client.get(balance_url, {'date': str(today)}).json(), Decimal('5.00')
+            )
+        self.client.post(transactions_url, data={'transaction_date': today, 'amount': '-1.50'})
+        self.assertEqual(self.client.get(balance_url).json(), Decimal('3.50'))
+        self.assertEqual(
+            self.client.get(balance_url, {'date': str(today)}).json(), Decimal('3.50')
+        )
+
+    def test_account_balances(self):
+        """ The balances of several Accounts come back from one query """
+        accounts = list(Account.objects.order_by('name', 'pk')[:4])
+        Transaction.objects.create(
+            account=accounts[0], transaction_date=datetime.date(2018, 1, 1), amount=3, active=True,
+        )
+        missing = '00000000-0000-0000-0000-000000000000'
+        account_ids = [str(account.uuid) for account in accounts] + [missing]
+        url = reverse('account-balances')
+        self.assertEqual(self.client.get(url, {'accounts': account_ids[0]}).status_code, 403)
+        self.client.login(username=self.superuser.username, password='derp')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'accounts': ','.join(account_ids)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([
+            query for query in context.captured_queries if 'fintech_' in query['sql']
+        ]), 1)
+        expected = [Decimal('8.00')] + [Decimal('5.00')] * 3 + [None]
+        self.assertEqual(list(response.json().keys()), account_ids)
+        self.assertEqual(list(response.json().values()), expected)
+
+        today = datetime.datetime.today().date()
+        for date, expected in [
+                (datetime.date(2017, 12, 31), [0] * 4 + [None]),
+                (datetime.date(2018, 1, 1), [3] + [0] * 3 + [None]),
+                (today - datetime.timedelta(days=1), [7] + [4] * 3 + [None]),
+        ]:
+            for response in [
+                    self.client.get(url, {'accounts': ','.join(account_ids), 'date': str(date)}),
+                    self.client.post(url, {'accounts': account_ids, 'date': str(date)},
+                                     content_type='application/json'),
+            ]:
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(list(response.json().values()), expected, date)
+
+        for data in [{'accounts': ''}, {'accounts': 'nope'},
+                     {'accounts': account_ids[0], 'date': '2018-02-30'}]:
+            self.assertEqual(self.client.get(url, data).status_code, 400, data)
+        response = self.client.post(
+            url, {'accounts': [missing] * 1001}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
     def test_account_balance_at_date(self):
         """ Tests the behaviour of the 'date' parameter """
         account = Account.objects.first()
@@ -103,6 +171,97 @@ class AccountViewsTestCase(TestCase):
         }
         self.assertEqual(response.json()['results'][0], expected_response)
 
+    def test_transactions_get_cursor(self):
+        """ Cursor pagination should walk the whole history without counting it """
+        account = Account.objects.first()
+        url = reverse('account-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        expected_uuids = [str(x) for x in account.transactions.order_by(
+            '-create_time', '-transaction_date', '-uuid'
+        ).values_list('uuid', flat=True)]
+
+        uuids = []
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'pagination': 'cursor', 'page_size': 2})
+        self.assertNotIn('count', response.json())
+        self.assertFalse(any('COUNT(' in query['sql'] for query in context.captured_queries))
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 2)
+            uuids.extend(x['uuid'] for x in response.json()['results'])
+            if not response.json()['next']:
+                break
+            response = self.client.get(response.json()['next'])
+        self.assertEqual(uuids, expected_uuids)
+
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 100000})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_transactions_get_row_serializer(self):
+        """ Listing from values() rows should give the same bytes as the serializer """
+        account = Account.objects.first()
+        for i in range(6):
+            Transaction.objects.create(
+                account=account, transaction_date=datetime.date(2018, 1, 31 - i),
+                amount=Decimal('1234.5'), active=bool(i % 2),
+                description='Ünicode "quoted" {}'.format(i),
+            )
+        url = reverse('account-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        for params in [{}, {'page': 2}, {'pagination': 'cursor', 'page_size': 4},
+                       {'format': 'json'}]:
+            fast_response = self.client.get(url, params)
+            with mock.patch.object(AccountViewSet, 'transaction_row_serializer', None):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(fast_response.content, response.content)
+
+    def test_transactions_get_filters(self):
+        """ The listing can be narrowed by date, amount, active and description """
+        account = Account.objects.first()
+        for i, (amount, active) in enumerate([('-1.00', True), ('-2.50', True), ('7.25', False)]):
+            Transaction.objects.create(
+                account=account, transaction_date=datetime.date(2018, 1, 1 + i),
+                amount=Decimal(amount), active=active, description='Filtered {}'.format(i),
+            )
+        url = reverse('account-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+
+        def descriptions(params):
+            response = self.client.get(url, dict(params, page_size=100))
+            self.assertEqual(response.status_code, 200)
+            return sorted(x['description'] for x in response.json()['results'])
+        self.assertEqual(
+            descriptions({'date_from': '2018-01-02', 'date_to': '2018-01-03'}),
+            ['Filtered 1', 'Filtered 2']
+        )
+        self.assertEqual(descriptions({'amount_max': '-1'}), ['Filtered 0', 'Filtered 1'])
+        self.assertEqual(descriptions({'amount_min': '-1.00', 'amount_max': '0'}), ['Filtered 0'])
+        self.assertEqual(descriptions({'active': 'false'}), ['Filtered 2'])
+        self.assertEqual(
+            descriptions({'description': 'Filt'}), ['Filtered 0', 'Filtered 1', 'Filtered 2']
+        )
+        self.assertEqual(descriptions({'description': 'filt'}), [])
+        self.assertEqual(
+            descriptions({'description': 'Filtered', 'active': 'TRUE', 'amount_min': '-2'}),
+            ['Filtered 0']
+        )
+        self.assertEqual(
+            descriptions({'date_to': '2018-01-02', 'pagination': 'cursor'}),
+            ['Filtered 0', 'Filtered 1']
+        )
+        # The filters carry over to the next page
+        response = self.client.get(
+            url, {'description': 'Filtered', 'pagination': 'cursor', 'page_size': 2}
+        )
+        self.assertEqual(len(response.json()['results']), 2)
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([x['description'] for x in response.json()['results']], ['Filtered 0'])
+        self.assertEqual(self.client.get(url, {'description': 'Filtered'}).json()['count'], 3)
+        for params in [{'date_from': '2018-13-01'}, {'amount_min': 'lots'},
+                       {'amount_max': '1.001'}, {'active': 'maybe'}]:
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
     def test_transactions_post(self):
         """ Should create the transaction and return the serialised representation """
         account = Account.objects.first()
@@ -160,3 +319,158 @@ class AccountViewsTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(Transaction.objects.count(), 100)
         self.assertEqual(account.balance, old_balance)
+
+    def test_bulk_transactions_post(self):
+        """ A JSON array of transactions should be created in one go """
+        account = Account.objects.first()
+        url = reverse('account-bulk-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        today = datetime.datetime.today().date()
+        data = [
+            {'transaction_date': str(today), 'amount': '-4.50', 'description': 'Bulk 0'},
+            {'transaction_date': str(today), 'amount': '10.25', 'description': 'Bulk 1'},
+            {'transaction_date': str(today), 'amount': '-10.00'},
+        ]
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [x['amount'] for x in response.json()], ['-4.50', '10.25', '-10.00']
+        )
+        self.assertEqual(Transaction.objects.count(), 103)
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('0.75'))
+        self.assertEqual(account.balance, account.calculated_balance)
+        self.assertEqual(account.balance_at_date(today), account.balance)
+
+    def test_bulk_transactions_post_ndjson(self):
+        """ Newline delimited JSON should be accepted too """
+        account = Account.objects.first()
+        url = reverse('account-bulk-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        today = datetime.datetime.today().date()
+        lines = [
+            json.dumps({'transaction_date': str(today), 'amount': str(i)}) for i in range(1, 4)
+        ]
+        response = self.client.post(
+            url, data='\n'.join(lines) + '\n', content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 3)
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('11.00'))
+
+    def test_illegal_bulk_transactions_post(self):
+        """ The whole batch should fail if the running balance goes below 0 at any point """
+        account = Account.objects.first()
+        url = reverse('account-bulk-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        today = datetime.datetime.today().date()
+        data = [
+            {'transaction_date': str(today), 'amount': '-6.00'},
+            {'transaction_date': str(today), 'amount': '10.00'},
+        ]
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[1], {})
+        self.assertIn('amount', response.json()[0])
+
+        data[0]['transaction_date'] = 'not a date'
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('transaction_date', response.json()[0])
+        self.assertEqual(Transaction.objects.count(), 100)
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('5.00'))
+
+    def test_empty_bulk_transactions_post(self):
+        """ An empty batch should be rejected, and adds nothing if saved directly """
+        account = Account.objects.first()
+        url = reverse('account-bulk-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+        response = self.client.post(url, data='[]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Expected at least one transaction'])
+
+        version = account.version
+        self.assertEqual(account.add_transactions([]), [])
+        self.assertEqual(account.balance, Decimal('5.00'))
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('5.00'))
+        self.assertEqual(account.version, version)
+        self.assertEqual(Transaction.objects.count(), 100)
+
+    def test_conditional_get(self):
+        """ Unchanged balances and transaction pages should get a 304 """
+        account = Account.objects.first()
+        self.client.login(username=self.superuser.username, password='derp')
+        today = datetime.datetime.today().date()
+        urls = [
+            (reverse('account-balance', args=(account.uuid,)), {}),
+            (reverse('account-balance', args=(account.uuid,)), {'date': str(today)}),
+            (reverse('account-transactions', args=(account.uuid,)), {}),
+            (reverse('account-transactions', args=(account.uuid,)), {'pagination': 'cursor'}),
+        ]
+        etags = []
+        for url, params in urls:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            etags.append(response['ETag'])
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+        self.assertEqual(len(set(etags)), len(etags))
+
+        # Any change to a transaction, even one leaving the balance alone, is a new version
+        transaction = account.transactions.first()
+        transaction.description = 'Renamed'
+        transaction.save()
+        for (url, params), etag in zip(urls, etags):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_export_transactions(self):
+        """ The full history should stream as CSV or NDJSON, optionally filtered by date """
+        account = Account.objects.first()
+        url = reverse('account-export-transactions', args=(account.uuid,))
+        self.client.login(username=self.superuser.username, password='derp')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(
+            line.decode() for line in b''.join(response.streaming_content).splitlines()
+        ))
+        self.assertEqual(rows[0][:4], ['uuid', 'account', 'transaction_date', 'amount'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][3], '1.00')
+
+        # NDJSON rows should match what the transactions listing returns
+        listed = self.client.get(reverse('account-transactions', args=(account.uuid,))).json()
+        response = self.client.get(url, {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        exported = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            sorted(exported, key=lambda x: x['uuid']),
+            sorted(listed['results'], key=lambda x: x['uuid'])
+        )
+
+        today = datetime.datetime.today().date()
+        response = self.client.get(url, {
+            'format': 'ndjson',
+            'date_from': str(today - datetime.timedelta(days=3)),
+            'date_to': str(today - datetime.timedelta(days=1)),
+        })
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+        response = self.client.get(url, {'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        # Errors are rendered in CSV too, as their messages
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            response.content.decode(),
+            "time data 'yesterday' does not match format '%Y-%m-%d'\r\n"
+        )
+        response = self.client.get(reverse('account-export-transactions', args=(uuid.uuid4(),)))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.content.decode(), 'detail\r\nNot found.\r\n')
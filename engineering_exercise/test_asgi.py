@@ -0,0 +1,91 @@
+""" Tests serving engineering_exercise through its ASGI application
+"""
+import asyncio
+import base64
+import datetime
+import threading
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import connections
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from fintech.models import Account, Transaction
+from .asgi import application
+
+
+class AsgiTestCase(TransactionTestCase):
+    """ Requests go through the ASGI application, which runs the views in
+    other threads, so the test data has to be committed """
+
+    def setUp(self):
+        """ An account with a couple of transactions """
+        User.objects.create_superuser(username='Superuser', password='derp', email='')
+        self.account = Account.objects.create(
+            user=User.objects.get(), name='Account', balance=0
+        )
+        for _ in range(2):
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=datetime.datetime.today().date(),
+                amount=1,
+                active=True,
+            )
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        connections.close_all()
+
+    async def request(self, path):
+        """ Sends a GET for path to the application, returning the status and body """
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'query_string': b'',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', b'Basic ' + base64.b64encode(b'Superuser:derp')),
+            ],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await application(scope, receive, send)
+        self.assertEqual(messages[0]['type'], 'http.response.start')
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return messages[0]['status'], body
+
+    def test_balance(self):
+        """ The balance is served as it is over WSGI """
+        url = reverse('account-balance', args=(self.account.uuid,))
+        status, body = self.loop.run_until_complete(self.request(url))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'2.0')
+
+    def test_concurrent_requests(self):
+        """ Requests run side by side in more than one thread """
+        threads = set()
+
+        def record_thread(**kwargs): #pylint: disable=W0613
+            threads.add(threading.get_ident())
+        request_started.connect(record_thread)
+        try:
+            url = reverse('account-transactions', args=(self.account.uuid,))
+
+            async def request_all():
+                # Gathered inside the running loop, which it then uses
+                return await asyncio.gather(*[self.request(url) for _ in range(8)])
+            results = self.loop.run_until_complete(request_all())
+        finally:
+            request_started.disconnect(record_thread)
+        self.assertEqual({status for status, _ in results}, {200})
+        self.assertGreater(len(threads), 1)
@@ -0,0 +1,118 @@
+""" Tests token authentication on the API of engineering_exercise
+"""
+import datetime
+from io import StringIO
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from fintech import token_cache
+from fintech.models import Account, ApiToken
+
+
+class TokenAuthenticationTestCase(TestCase):
+    """ Tests authenticating with ApiTokens, and that cached ones are dropped
+    when they are revoked or their User's permissions change """
+
+    def setUp(self):
+        """ A staff user allowed to add transactions, with a token """
+        self.user = User.objects.create_user(username='Machine client', is_staff=True)
+        self.add_account = Permission.objects.get(
+            content_type__app_label='fintech', codename='add_account'
+        )
+        self.user.user_permissions.add(self.add_account)
+        self.account = Account.objects.create(user=self.user, name='Account', balance=0)
+        self.token, self.key = ApiToken.create_token(self.user, 'Client')
+        self.url = reverse('account-transactions', args=(self.account.uuid,))
+
+    def post(self, key=None):
+        """ POSTs a new Transaction authenticated with key (self.key by default) """
+        return self.client.post(self.url, {
+            'transaction_date': str(datetime.datetime.today().date()),
+            'amount': '1.00',
+        }, HTTP_AUTHORIZATION='Token {}'.format(key or self.key))
+
+    def assert_refused(self, key=None):
+        """ The token is refused, with 403 as for any unauthenticated request """
+        response = self.post(key)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+    def test_only_hash_stored(self):
+        """ The key itself is never stored """
+        self.assertEqual(self.token.key_hash, ApiToken.hash_key(self.key))
+        self.assertEqual(self.token.key_prefix, self.key[:8])
+        self.assertFalse(ApiToken.objects.filter(key_hash=self.key).exists())
+
+    def test_cached_authentication(self):
+        """ Once cached, a token costs no queries on the auth tables """
+        self.assertEqual(self.post().status_code, 201)
+        hits = token_cache.stats()['hits']
+        # Otherwise the query log is emptied as the request starts
+        request_started.disconnect(reset_queries)
+        self.addCleanup(request_started.connect, reset_queries)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(token_cache.stats()['hits'], hits + 1)
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertTrue(queries)
+        self.assertFalse([sql for sql in queries if '"auth_' in sql])
+
+    def test_invalid_tokens(self):
+        """ Unknown and revoked tokens, and inactive users, are refused """
+        self.assert_refused('not-a-token')
+        self.assertEqual(self.post().status_code, 201)
+        self.token.revoke()
+        self.assert_refused()
+
+        _, key = ApiToken.create_token(self.user, 'Second client')
+        self.assertEqual(self.post(key).status_code, 201)
+        self.user.is_active = False
+        self.user.save()
+        self.assert_refused(key)
+
+    def test_deleted_token(self):
+        """ Deleting a token drops it from the cache """
+        self.post()
+        ApiToken.objects.filter(pk=self.token.pk).delete()
+        self.assert_refused()
+
+    def test_permission_changes(self):
+        """ Changes to a User's permissions, directly or through a Group, apply at once """
+        self.assertEqual(self.post().status_code, 201)
+        self.user.user_permissions.remove(self.add_account)
+        self.assertEqual(self.post().status_code, 403)
+
+        group = Group.objects.create(name='Clients')
+        self.user.groups.add(group)
+        self.assertEqual(self.post().status_code, 403)
+        group.permissions.add(self.add_account)
+        self.assertEqual(self.post().status_code, 201)
+        self.add_account.group_set.clear()
+        self.assertEqual(self.post().status_code, 403)
+
+    def test_admin_revoke(self):
+        """ Tokens are revoked from the admin """
+        superuser = User.objects.create_superuser(username='Superuser', email='', password=None)
+        self.client.force_login(superuser)
+        response = self.client.post(reverse('admin:fintech_apitoken_changelist'), {
+            'action': 'revoke', '_selected_action': [self.token.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.client.logout()
+        self.assertIsNotNone(ApiToken.objects.get(pk=self.token.pk).revoke_time)
+        self.assert_refused()
+
+    def test_create_api_token_command(self):
+        """ The command prints a working key """
+        out = StringIO()
+        call_command('create_api_token', 'Machine client', 'Command client', stdout=out)
+        key = out.getvalue().strip()
+        self.assertEqual(
+            ApiToken.objects.get(key_hash=ApiToken.hash_key(key)).name, 'Command client'
+        )
+        self.assertEqual(self.post(key).status_code, 201)
@@ -0,0 +1,139 @@
+""" Tests Idempotency-Key support on the transaction POSTs of engineering_exercise
+"""
+import datetime
+import json
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from fintech.models import Account, IdempotencyKey, Transaction
+
+
+class IdempotencyTestCase(TestCase):
+    """ Tests replaying POSTs made with an Idempotency-Key header """
+
+    def setUp(self):
+        """ An account with 2.00 in it """
+        self.superuser = User.objects.create_superuser(
+            username='Superuser', is_staff=True, password='derp', email='stephen@saruste.fi'
+        )
+        self.account = Account.objects.create(user=self.superuser, name='Account', balance=0)
+        for _ in range(2):
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=datetime.datetime.today().date(),
+                amount=1,
+                active=True,
+            )
+        self.url = reverse('account-transactions', args=(self.account.uuid,))
+        self.data = {
+            'transaction_date': str(datetime.datetime.today().date()),
+            'amount': '-1.50',
+            'description': 'Retried',
+        }
+        self.client.login(username=self.superuser.username, password='derp')
+
+    def post(self, key, data=None, url=None):
+        """ POSTs data (self.data by default) with key as the Idempotency-Key """
+        return self.client.post(
+            url or self.url, data or self.data, content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def assert_balance(self, balance):
+        """ The stored balance, and the Transactions, come to balance """
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertEqual(account.balance, Decimal(balance))
+        self.assertEqual(account.calculated_balance, Decimal(balance))
+
+    def test_retry_replayed(self):
+        """ A retry gets the original response, and no second Transaction """
+        response = self.post('retry-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        with CaptureQueriesContext(connection) as context:
+            replayed = self.post('retry-1')
+        self.assertEqual(replayed.status_code, 201)
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertEqual(replayed.json(), response.json())
+        # The balance path isn't touched
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'fintech_account' in query['sql'] and not query['sql'].startswith('SELECT')
+        ])
+        self.assertEqual(Transaction.objects.filter(description='Retried').count(), 1)
+        self.assert_balance('0.50')
+
+    def test_different_keys(self):
+        """ Each key makes its own change """
+        for key in ('a', 'b'):
+            self.assertEqual(self.post(key, dict(self.data, amount='-0.50')).status_code, 201)
+        self.assert_balance('1.00')
+
+    def test_without_key(self):
+        """ POSTs without a key aren't deduplicated """
+        for _ in range(2):
+            self.client.post(self.url, dict(self.data, amount='-0.50'))
+        self.assert_balance('1.00')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_key_reused_for_different_request(self):
+        """ A key can't be used for a different request """
+        self.post('reused')
+        response = self.post('reused', dict(self.data, amount='-0.25'))
+        self.assertEqual(response.status_code, 422)
+        bulk_url = reverse('account-bulk-transactions', args=(self.account.uuid,))
+        response = self.client.post(
+            bulk_url, json.dumps([self.data]), content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY='reused'
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assert_balance('0.50')
+
+    def test_failures_not_stored(self):
+        """ A refused POST can be retried with the same key once it would succeed """
+        self.assertEqual(self.post('overdraw', dict(self.data, amount='-3.00')).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        Transaction.objects.create(
+            account=self.account, transaction_date=datetime.datetime.today().date(),
+            amount=1, active=True,
+        )
+        self.assertEqual(self.post('overdraw', dict(self.data, amount='-3.00')).status_code, 201)
+        self.assert_balance('0.00')
+
+    def test_invalid_key(self):
+        """ Keys must be between 1 and 255 characters """
+        for key in ('', 'k' * 256):
+            self.assertEqual(self.post(key).status_code, 400)
+        self.assert_balance('2.00')
+
+    def test_bulk_retry_replayed(self):
+        """ Bulk POSTs are replayed too """
+        url = reverse('account-bulk-transactions', args=(self.account.uuid,))
+        data = json.dumps([dict(self.data, amount='-0.50'), dict(self.data, amount='-0.75')])
+        responses = [
+            self.client.post(
+                url, data, content_type='application/json', HTTP_IDEMPOTENCY_KEY='bulk'
+            )
+            for _ in range(2)
+        ]
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[1].json(), responses[0].json())
+        self.assert_balance('0.75')
+
+    def test_keys_expire(self):
+        """ An expired key is forgotten, and purged by purge_idempotency_keys """
+        self.post('expiring')
+        with self.settings(IDEMPOTENCY_KEY_TTL_SECONDS=0):
+            response = self.post('expiring', dict(self.data, amount='-0.25'))
+            self.assertNotIn('Idempotent-Replayed', response)
+            self.assert_balance('0.25')
+            out = StringIO()
+            call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('1 expired idempotency keys removed', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
@@ -0,0 +1,58 @@
+""" Tests the request instrumentation of engineering_exercise
+"""
+import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from fintech.models import Account, Transaction
+from .instrumentation import registry
+
+
+class InstrumentationTestCase(TestCase):
+    """ Tests the Server-Timing header and the metrics registry """
+
+    def setUp(self):
+        """ An account with a couple of transactions """
+        registry.reset()
+        self.superuser = User.objects.create_superuser(
+            username='Superuser', is_staff=True, password='derp', email='stephen@saruste.fi'
+        )
+        self.account = Account.objects.create(user=self.superuser, name='Account', balance=0)
+        for _ in range(2):
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=datetime.datetime.today().date(),
+                amount=1,
+                active=True,
+            )
+        self.client.login(username=self.superuser.username, password='derp')
+
+    def test_server_timing_header(self):
+        """ Responses should say how long was spent where """
+        url = reverse('account-transactions', args=(self.account.uuid,))
+        response = self.client.get(url)
+        server_timing = response['Server-Timing']
+        for name in ('db;', 'serializer;', 'render;', 'total;'):
+            self.assertIn(name, server_timing)
+        self.assertRegex(server_timing, r'desc="[1-9]\d* queries"')
+
+    def test_metrics_registry(self):
+        """ Requests are aggregated per route and dumped at /metrics/ """
+        url = reverse('account-balance', args=(self.account.uuid,))
+        for _ in range(3):
+            self.client.get(url)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        route = response.json()['routes']['GET account-balance']
+        self.assertEqual(route['duration_ms']['count'], 3)
+        self.assertEqual(route['queries']['buckets']['+Inf'], 3)
+        self.assertGreater(route['response_bytes']['sum'], 0)
+        self.assertIn('hits', response.json()['balance_cache'])
+
+    def test_metrics_staff_only(self):
+        """ Only staff may see the metrics """
+        user = User.objects.create_user(username='Customer', password='derp')
+        self.client.login(username=user.username, password='derp')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,93 @@
+""" Tests the production settings of engineering_exercise
+"""
+import importlib
+import os
+import sys
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from fintech.connections import SQLITE_WAL_PRAGMAS
+
+MODULE = 'engineering_exercise.settings_production'
+
+
+class ProductionSettingsTestCase(SimpleTestCase):
+    """ Tests settings_production takes its database set up from the environment """
+
+    @staticmethod
+    def load(**environ):
+        """ A freshly imported settings_production, with the variables it reads
+        taken from environ rather than the real environment """
+        environ = dict({
+            name: value for name, value in os.environ.items()
+            if not name.startswith(
+                ('DATABASE_', 'SQLITE_', 'BALANCE_CACHE_', 'DJANGO_SECRET', 'DJANGO_ALLOWED')
+            )
+        }, **environ)
+        sys.modules.pop(MODULE, None)
+        try:
+            with mock.patch.dict(os.environ, environ, clear=True):
+                return importlib.import_module(MODULE)
+        finally:
+            sys.modules.pop(MODULE, None)
+
+    def test_sqlite(self):
+        """ SQLite keeps its connections and is put in WAL mode """
+        production = self.load(
+            DJANGO_SECRET_KEY='secret', DJANGO_ALLOWED_HOSTS='a.example,b.example'
+        )
+        self.assertFalse(production.DEBUG)
+        self.assertEqual(production.ALLOWED_HOSTS, ['a.example', 'b.example'])
+        database = production.DATABASES['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['CONN_MAX_AGE'], 600)
+        self.assertEqual(database['OPTIONS'], {'timeout': 20})
+        self.assertEqual(production.SQLITE_PRAGMAS, SQLITE_WAL_PRAGMAS)
+
+        production = self.load(
+            DJANGO_SECRET_KEY='secret', DATABASE_NAME='/srv/db.sqlite3',
+            DATABASE_CONN_MAX_AGE='0', SQLITE_MMAP_SIZE='0',
+        )
+        database = production.DATABASES['default']
+        self.assertEqual((database['NAME'], database['CONN_MAX_AGE']), ('/srv/db.sqlite3', 0))
+        self.assertEqual(production.SQLITE_PRAGMAS['mmap_size'], 0)
+
+    def test_postgresql(self):
+        """ The PostgreSQL connection parameters come from the environment """
+        production = self.load(
+            DJANGO_SECRET_KEY='secret', DATABASE_ENGINE='postgresql', DATABASE_NAME='ledger',
+            DATABASE_HOST='db.example', DATABASE_PORT='6432', DATABASE_PGBOUNCER='1',
+            DATABASE_STATEMENT_TIMEOUT_MS='5000',
+        )
+        database = production.DATABASES['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(
+            (database['NAME'], database['HOST'], database['PORT']),
+            ('ledger', 'db.example', '6432')
+        )
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(database['OPTIONS']['options'], '-c statement_timeout=5000')
+        self.assertEqual(production.SQLITE_PRAGMAS, {})
+
+    def test_balance_cache(self):
+        """ Balances are only cached in a shared backend """
+        production = self.load(DJANGO_SECRET_KEY='secret')
+        self.assertEqual(
+            production.CACHES[production.BALANCE_CACHE_ALIAS]['BACKEND'],
+            'django.core.cache.backends.dummy.DummyCache'
+        )
+        production = self.load(
+            DJANGO_SECRET_KEY='secret', BALANCE_CACHE_LOCATION='cache.example:11211'
+        )
+        self.assertEqual(production.CACHES[production.BALANCE_CACHE_ALIAS], {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': 'cache.example:11211',
+            'TIMEOUT': 300,
+        })
+
+    def test_misconfigured(self):
+        """ Missing or invalid values are refused """
+        for environ in ({}, {'DATABASE_ENGINE': 'oracle'}, {'DATABASE_CONN_MAX_AGE': 'forever'}):
+            with self.assertRaises(ImproperlyConfigured):
+                self.load(**dict({'DJANGO_SECRET_KEY': 'secret'} if environ else {}, **environ))
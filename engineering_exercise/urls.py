@@ -17,7 +17,7 @@ from django.contrib import admin
 from django.conf.urls import include, url
 from django.urls import path
 from rest_framework import routers
-from .views import AccountViewSet
+from .views import AccountViewSet, MetricsView
 
 
 router = routers.DefaultRouter() #pylint: disable=C0103
@@ -28,5 +28,6 @@ router.register('account', AccountViewSet)
 urlpatterns = [ #pylint: disable=C0103
     path('admin/', admin.site.urls),
     url('^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     url('^', include(router.urls)),
 ]
@@ -2,20 +2,140 @@
 
 Implementations of the Django REST framework pattern
 """
+import csv
 import datetime
-from rest_framework import serializers, viewsets, status
+import hashlib
+import itertools
+import json
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
+from rest_framework import permissions, serializers, viewsets, status
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from fintech import balance_cache
+from fintech.models import Account, DailyBalance, Transaction
+from fintech.errors import AccountBalanceError, BatchAccountBalanceError
+from fintech.search import prefix_search
+from .idempotency import idempotent
+from .instrumentation import registry, timer
+from .parsers import NDJSONParser
+from .renderers import CSVRenderer, NDJSONRenderer
+from .row_serializers import RowSerializer, format_datetime
+
+MAX_BULK_TRANSACTIONS = 10000
+MAX_BATCH_BALANCES = 1000
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = (
+    'uuid',
+    'account',
+    'transaction_date',
+    'amount',
+    'description',
+    'active',
+    'create_time',
+    'update_time',
+)
+
+def _etag(*parts):
+    """ A strong ETag for a response determined by parts """
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def _parse_date(date_string):
+    """ Parses a '%Y-%m-%d' query parameter """
+    try:
+        return datetime.datetime.strptime(date_string, '%Y-%m-%d').date()
+    except ValueError as err:
+        raise serializers.ValidationError(str(err)) from err
+
+
+def _parse_amount(amount_string):
+    """ Parses an amount query parameter as amounts sent to the API are """
+    return TransactionSerializer().fields['amount'].to_internal_value(amount_string)
+
+
+def _parse_boolean(boolean_string):
+    """ Parses a 'true' or 'false' query parameter """
+    try:
+        return {'true': True, 'false': False}[boolean_string.lower()]
+    except KeyError as err:
+        raise serializers.ValidationError(
+            '{} is not true or false'.format(boolean_string)
+        ) from err
+
+
+def _filter_transactions(request, query):
+    """ Narrows query by the optional query parameters 'date_from' and
+    'date_to' ('%Y-%m-%d', inclusive) on the transaction date, 'amount_min'
+    and 'amount_max' (inclusive) on the amount, 'active' ('true' or 'false',
+    staff only) and 'description', a prefix of the description. They turn
+    into range and equality conditions the database can use indexes for """
+    params = request.query_params
+    if params.get('date_from'):
+        query = query.filter(transaction_date__gte=_parse_date(params['date_from']))
+    if params.get('date_to'):
+        query = query.filter(transaction_date__lte=_parse_date(params['date_to']))
+    if params.get('amount_min'):
+        query = query.filter(amount__gte=_parse_amount(params['amount_min']))
+    if params.get('amount_max'):
+        query = query.filter(amount__lte=_parse_amount(params['amount_max']))
+    if params.get('active'):
+        if not request.user.is_staff:
+            raise serializers.ValidationError('Only staff can filter on active')
+        query = query.filter(active=_parse_boolean(params['active']))
+    if params.get('description'):
+        query = query.filter(prefix_search(query.model, 'description', params['description']))
+    return query
+
+
+def _export_row(values):
+    """ Turns a values_list row of EXPORT_FIELDS into strings and booleans """
+    uuid, account, transaction_date, amount, description, active, create_time, update_time = values
+    return (
+        str(uuid), str(account), transaction_date.isoformat(), '{:f}'.format(amount),
+        description, active, format_datetime(create_time), format_datetime(update_time),
+    )
+
+
+class _Echo: # pylint: disable=R0903
+    """ File-like object handing back what is written, for csv.writer """
+    @staticmethod
+    def write(value):
+        """ Returns value rather than storing it """
+        return value
+
+
+def _not_modified(request, etag):
+    """ Returns a 304 response if the request's If-None-Match matches etag """
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return None
 
-from fintech.models import Account, Transaction
-from fintech.errors import AccountBalanceError
 
 class AccountBalanceValidationError(serializers.ValidationError):
     """ For validation errors involving the Account balance """
     pass
 
 
+class ReadOnlyPostModelPermissions(permissions.DjangoModelPermissions):
+    """ DjangoModelPermissions for POSTs that only read, so need no more
+    than a GET does """
+    perms_map = dict(permissions.DjangoModelPermissions.perms_map, POST=[])
+
+
+class BalancesRequestSerializer(serializers.Serializer): #pylint: disable=W0223
+    """ Validates the Accounts and date asked for by AccountViewSet.balances """
+    accounts = serializers.ListField(
+        child=serializers.UUIDField(), min_length=1, max_length=MAX_BATCH_BALANCES
+    )
+    date = serializers.DateField(required=False)
+
+
 class AccountSerializer(serializers.ModelSerializer):
     """ Serialises the base information regarding an Account """
     class Meta: #pylint: disable=R0903
@@ -47,59 +167,138 @@ class TransactionSerializer(serializers.ModelSerializer):
         }
 
 
+class TransactionCursorPagination(CursorPagination):
+    """ Keyset pagination over an Account's Transactions, most recent first.
+    There's no total count, so a deep page costs the same as the first one """
+    ordering = ('-create_time', '-transaction_date', '-uuid')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
 class AccountViewSet(viewsets.GenericViewSet): # pylint: disable=R0901
     """ Allows users to interact with the Account object"""
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
+    # Lists Transactions from values() rows rather than through
+    # TransactionSerializer. None lists them through the serializer
+    transaction_row_serializer = RowSerializer(TransactionSerializer)
 
     @staticmethod
     def _calculate_balance_at_date(account, date):
         """ Returns the sum of the amount of all active transactions
         made on or before the date on a given account """
-        transactions = Transaction.objects.filter(
-            account=account, transaction_date__lte=date, active=True
-        ).all()
-        balance = sum(x.amount for x in transactions)
-        return balance
+        return account.balance_at_date(date)
 
 
     @action(detail=True, methods=['get'])
     def balance(self, request, pk=None): #pylint: disable=C0103
         """ Returns the current balance for the Account as a decimal.
         If you specify the 'date' ('%Y-%m-%d') as a query parameter
-        it will return the balance at the close of that date."""
-        account = self.get_object()
+        it will return the balance at the close of that date.
+        The ETag follows Account.version, so If-None-Match requests
+        get a 304 until the Account changes."""
+        date = None
         date_string = request.query_params.get('date')
         if date_string:
-            try:
-                date = datetime.datetime.strptime(date_string, '%Y-%m-%d').date()
-            except ValueError as err:
-                raise serializers.ValidationError(str(err)) from err
-            balance = self._calculate_balance_at_date(account, date)
+            date = _parse_date(date_string)
+
+        def load_balance():
+            account = self.get_object()
+            if date:
+                return self._calculate_balance_at_date(account, date), account.version
+            return account.balance, account.version
+
+        # Any user allowed on this view can see every Account, so a cache hit
+        # can skip the get_object() lookup
+        balance, version = balance_cache.get_or_load(pk, date, load_balance)
+        etag = _etag(pk, version, date, request.accepted_media_type)
+        return _not_modified(request, etag) or Response(balance, headers={'ETag': etag})
+
+
+    @action(
+        detail=False, methods=['get', 'post'], permission_classes=[ReadOnlyPostModelPermissions]
+    )
+    def balances(self, request):
+        """ Returns the balances of a batch of Accounts, as {uuid: balance}
+        with null for those not found. Takes 'accounts', a list of up to
+        MAX_BATCH_BALANCES uuids, and optionally 'date' as balance does.
+        Either as query parameters, with the uuids comma separated, or POSTed
+        as JSON for lists too long for a URL. All the balances are read in
+        one query """
+        if request.method == 'POST':
+            data = request.data
         else:
-            balance = account.balance
-        return Response(balance)
+            data = {'accounts': request.query_params.get('accounts', '').split(',')}
+            if request.query_params.get('date'):
+                data['date'] = request.query_params['date']
+        serializer = BalancesRequestSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        account_ids = serializer.validated_data['accounts']
+        date = serializer.validated_data.get('date')
 
+        accounts = self.filter_queryset(self.get_queryset()).filter(pk__in=account_ids)
+        if date:
+            balances = DailyBalance.balances_at(accounts, date)
+        else:
+            balances = dict(accounts.values_list('pk', 'balance'))
+        return Response({
+            str(account_id): balances.get(account_id) for account_id in account_ids
+        })
 
-    def _transactions_get(self, request, account):
+
+    @staticmethod
+    def _visible_transactions(request, account):
         """ Customers may not interact with Transactions that are not 'active'
         TODO - behaviour here dependent on the auth framework.
         We currently assume only staff users, not customers, have access
         """
         if request.user.is_staff:
-            query = Transaction.objects.filter(account=account).\
-                order_by('-create_time', '-transaction_date')
-        else:
-            raise NotImplementedError()
-            #query = Transaction.objects.filter(account=account, active=True)
+            return Transaction.objects.filter(account=account)
+        raise NotImplementedError()
+        #return Transaction.objects.filter(account=account, active=True)
+
+
+    def _transactions_get(self, request, account):
+        """ Lists the Transactions visible to the user, most recent first,
+        narrowed by the filters of _filter_transactions.
+        Paginated by page number unless 'pagination=cursor' is given as a
+        query parameter, in which case TransactionCursorPagination is used.
+        Rows are serialised by transaction_row_serializer if it is set.
+
+        The ETag follows Account.version, so If-None-Match requests get a
+        304 without the Transactions being loaded until the Account changes.
+        """
+        query = _filter_transactions(request, self._visible_transactions(request, account)).\
+            order_by('-create_time', '-transaction_date')
+
+        etag = _etag(
+            account.pk, account.version, request.get_host(), request.get_full_path(),
+            request.accepted_media_type
+        )
+        not_modified = _not_modified(request, etag)
+        if not_modified:
+            return not_modified
 
         transactions = query.all()
 
-        paginator = PageNumberPagination()
-        paginator.page_size = 10
+        if request.query_params.get('pagination') == 'cursor':
+            paginator = TransactionCursorPagination()
+        else:
+            paginator = PageNumberPagination()
+            paginator.page_size = 10
+        row_serializer = self.transaction_row_serializer
+        if row_serializer is not None:
+            transactions = row_serializer.values(transactions)
         paginated_queryset = paginator.paginate_queryset(transactions, request)
-        serializer = self.serializer_class(paginated_queryset, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        with timer('serializer'):
+            if row_serializer is not None:
+                data = row_serializer.serialize(paginated_queryset)
+            else:
+                data = self.serializer_class(paginated_queryset, many=True).data
+        response = paginator.get_paginated_response(data)
+        response['ETag'] = etag
+        return response
 
 
     def _transactions_post(self, request, account):
@@ -116,17 +315,114 @@ class AccountViewSet(viewsets.GenericViewSet): # pylint: disable=R0901
             except AccountBalanceError as err:
                 raise AccountBalanceValidationError(str(err)) from err
             serializer = self.serializer_class(transaction, many=False)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            with timer('serializer'):
+                data = serializer.data
+            return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
     @action(detail=True, methods=['get', 'post'])
     def transactions(self, request, pk=None): #pylint: disable=C0103
-        """ For interacting with Transactions on this Account"""
+        """ For interacting with Transactions on this Account.
+        A POST retried with the same Idempotency-Key header gets the
+        original response back rather than creating the Transaction again """
         self.serializer_class = TransactionSerializer
         account = self.get_object()
 
         if request.method == 'POST':
-            return self._transactions_post(request, account)
+            return idempotent(request, account, lambda: self._transactions_post(request, account))
 
         return self._transactions_get(request, account)
+
+
+    @action(
+        detail=True, methods=['post'], url_path='transactions/bulk',
+        parser_classes=[JSONParser, NDJSONParser]
+    )
+    def bulk_transactions(self, request, pk=None): #pylint: disable=C0103
+        """ Creates a batch of Transactions, sent as a JSON array or as
+        newline delimited JSON (Content-Type: application/x-ndjson).
+        The batch is saved in order and as a whole, or not at all. The response
+        is a list with an entry for each Transaction sent: the serialised
+        Transactions on success, or the errors for each one (empty if valid).
+        Takes an Idempotency-Key header as transactions does """
+        account = self.get_object()
+        return idempotent(request, account, lambda: self._bulk_transactions_post(request, account))
+
+
+    @staticmethod
+    def _bulk_transactions_post(request, account):
+        """ Validates and saves the batch for bulk_transactions """
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError('Expected a list of transactions')
+        if not request.data:
+            raise serializers.ValidationError('Expected at least one transaction')
+        if len(request.data) > MAX_BULK_TRANSACTIONS:
+            raise serializers.ValidationError(
+                'At most {} transactions can be sent at once'.format(MAX_BULK_TRANSACTIONS)
+            )
+
+        serializer = TransactionSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        transactions = [
+            Transaction(active=True, **validated_data)
+            for validated_data in serializer.validated_data
+        ]
+        try:
+            account.add_transactions(transactions)
+        except BatchAccountBalanceError as err:
+            errors = [{} for _ in transactions]
+            errors[err.index] = {'amount': [str(err)]}
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer = TransactionSerializer(transactions, many=True)
+        with timer('serializer'):
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+    @action(
+        detail=True, methods=['get'], url_path='transactions/export',
+        renderer_classes=[CSVRenderer, NDJSONRenderer]
+    )
+    def export_transactions(self, request, pk=None): #pylint: disable=C0103
+        """ Streams every Transaction on the Account, oldest first, as CSV
+        (the default, or ?format=csv) or NDJSON (?format=ndjson), narrowed
+        by the filters of _filter_transactions.
+        Rows are read from the database in chunks as the response is sent,
+        so memory use doesn't grow with the history """
+        account = self.get_object()
+        query = _filter_transactions(request, self._visible_transactions(request, account))
+        rows = (
+            _export_row(values) for values in
+            query.order_by('create_time', 'transaction_date', 'uuid').
+            values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+
+        renderer = request.accepted_renderer
+        if renderer.format == 'ndjson':
+            lines = (json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in rows)
+        else:
+            writer = csv.writer(_Echo())
+            lines = (writer.writerow(row) for row in itertools.chain([EXPORT_FIELDS], rows))
+        response = StreamingHttpResponse(
+            lines, content_type='{}; charset={}'.format(renderer.media_type, renderer.charset)
+        )
+        response['Content-Disposition'] = 'attachment; filename="transactions-{}.{}"'.format(
+            account.pk, renderer.format
+        )
+        return response
+
+
+class MetricsView(APIView):
+    """ Staff only dump of the per route request histograms recorded by
+    engineering_exercise.instrumentation """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request): #pylint: disable=W0613,R0201
+        """ Returns the per route histograms and the balance cache counters """
+        return Response({
+            'routes': registry.snapshot(),
+            'balance_cache': balance_cache.stats(),
+        })
@@ -1,10 +1,80 @@
 from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
 from django.shortcuts import redirect
-from .models import Account, Transaction
-from .errors import AccountBalanceError
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import Account, ApiToken, AuditEntry, Transaction
+from .errors import AccountBalanceError, JournalEntryError
+from .search import prefix_search
+
+# Below this many rows an exact count is cheap enough
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+def estimated_count(model, using):
+    """ The number of rows in model's table according to the database's
+    statistics, or None if there is no estimate """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # Only deletes make this an overestimate
+            cursor.execute('SELECT MAX(_rowid_) FROM {}'.format(table))
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """ Takes the count of an unfiltered queryset on a big table from the
+    database's statistics rather than counting every row """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class PrefixSearchMixin:
+    """ Searches search_fields for values starting with the search term,
+    instead of the unindexable icontains scan for each word of the default
+    search """
+    def get_search_results(self, request, queryset, search_term): #pylint: disable=W0613
+        search_term = search_term.strip()
+        if search_term:
+            conditions = Q()
+            for path in self.search_fields:
+                conditions |= prefix_search(queryset.model, path, search_term)
+            queryset = queryset.filter(conditions)
+        return queryset, False
+
+
+class LatestTransactionsFormSet(BaseInlineFormSet):
+    """ Only the latest `limit` Transactions of the Account """
+    limit = 50
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            self._queryset = super().get_queryset()[:self.limit]
+        return self._queryset
+
 
 class TransactionInline(admin.TabularInline):
     model = Transaction
+    formset = LatestTransactionsFormSet
+    verbose_name_plural = 'Latest {} transactions'.format(LatestTransactionsFormSet.limit)
     fields = ('uuid', 'transaction_date', 'amount', 'description', 'active')
     ordering = ('-create_time', '-transaction_date')
     readonly_fields = fields
@@ -17,32 +87,87 @@ class TransactionInline(admin.TabularInline):
     def has_add_permission(self, request, obj=None):
         return False
 
-class AccountAdmin(admin.ModelAdmin):
+class AccountAdmin(PrefixSearchMixin, admin.ModelAdmin):
     list_display = ('uuid', 'name', 'user', 'balance')
+    list_select_related = ('user',)
     inlines = (TransactionInline,)
     search_fields = ('name', 'user__username')
-    readonly_fields = ('uuid', 'user', 'balance',)
+    readonly_fields = ('uuid', 'user', 'balance', 'all_transactions')
+
+    def all_transactions(self, obj):
+        """ Links to the changelist of every Transaction on the Account,
+        without counting them as that grows with the Account """
+        return format_html(
+            '<a href="{}?account__exact={}">All transactions</a>',
+            reverse('admin:fintech_transaction_changelist'), obj.pk
+        )
+    all_transactions.short_description = 'Transactions'
 
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(PrefixSearchMixin, admin.ModelAdmin):
     list_display = ('uuid', 'description', 'transaction_date', 'account')
+    list_select_related = ('account',)
+    raw_id_fields = ('account',)
     readonly_fields = ('uuid',)
     search_fields = ('description', 'account__name', 'account__user__username')
     list_filter = ['transaction_date']
     ordering = ('-transaction_date', '-create_time')
+    paginator = EstimatedCountPaginator
+    # Filtered changelists would otherwise count the whole table as well
+    show_full_result_count = False
 
     def save_model(self, request, obj, form, change):
         try:
             super().save_model(request, obj, form, change)
-        except AccountBalanceError as err:
+        except (AccountBalanceError, JournalEntryError) as err:
             messages.error(request, err)
             return redirect('admin:fintech_transaction_changelist')
 
     def delete_model(self, request, obj):
         try:
             super().delete_model(request, obj)
-        except AccountBalanceError as err:
+        except (AccountBalanceError, JournalEntryError) as err:
             messages.error(request, err)
             return redirect('admin:fintech_transaction_changelist')
 
+class AuditEntryAdmin(admin.ModelAdmin):
+    """ Read only, as the log is append only """
+    list_display = ('time', 'source', 'username', 'model', 'object_id', 'action')
+    list_filter = ('source', 'model', 'action')
+    search_fields = ('=object_id', '=username')
+    ordering = ('-time',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class ApiTokenAdmin(admin.ModelAdmin):
+    """ Tokens are created with the create_api_token command, which shows
+    the key once, and revoked here """
+    list_display = ('name', 'key_prefix', 'user', 'create_time', 'revoke_time')
+    list_select_related = ('user',)
+    search_fields = ('=key_prefix', '=user__username')
+    readonly_fields = ('user', 'key_prefix', 'create_time', 'revoke_time')
+    actions = ('revoke',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def revoke(self, request, queryset):
+        """ Revokes the selected tokens """
+        tokens = list(queryset.filter(revoke_time__isnull=True))
+        for token in tokens:
+            token.revoke()
+        messages.success(request, '{} tokens revoked'.format(len(tokens)))
+    revoke.short_description = 'Revoke selected tokens'
+
 admin.site.register(Account, AccountAdmin)
+admin.site.register(ApiToken, ApiTokenAdmin)
+admin.site.register(AuditEntry, AuditEntryAdmin)
 admin.site.register(Transaction, TransactionAdmin)
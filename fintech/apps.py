@@ -1,5 +1,22 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 
 class FintechConfig(AppConfig):
     name = 'fintech'
+
+    def ready(self):
+        from django.contrib.auth.models import Group, User
+        from . import token_cache
+        from .connections import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='fintech_sqlite_pragmas')
+
+        # Cached API tokens go stale when their User or its permissions change
+        api_token = self.get_model('ApiToken')
+        post_delete.connect(token_cache.token_deleted, sender=api_token)
+        for signal in (post_save, post_delete):
+            signal.connect(token_cache.user_changed, sender=User)
+        for through in (User.groups.through, User.user_permissions.through):
+            m2m_changed.connect(token_cache.user_permissions_changed, sender=through)
+        m2m_changed.connect(token_cache.group_permissions_changed, sender=Group.permissions.through)
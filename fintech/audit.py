@@ -0,0 +1,221 @@
+""" Append-only audit log of changes to Accounts and Transactions
+
+record() notes who changed what, with the values before and after, once the
+change has been committed. Entries go on an in-process queue and a
+background thread writes them to AuditEntry in batches, so the code making
+the change never waits on the inserts. The thread is started on first use
+(again after a fork) and writes whatever is still queued when the process
+exits normally. Processes ended otherwise, such as multiprocessing workers,
+should call flush() when done.
+
+Who made a change and through what comes from context(). The
+AuditContextMiddleware sets it for each request; outside a request changes
+are put down to the management command running, or to 'system'.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__) #pylint: disable=C0103
+
+_local = threading.local() #pylint: disable=C0103
+_writer_lock = threading.Lock()
+_writer = None #pylint: disable=C0103
+
+
+def _default_source():
+    """ The management command running, or 'system' """
+    if os.path.basename(sys.argv[0]) == 'manage.py' and len(sys.argv) > 1:
+        return 'manage.py {}'.format(sys.argv[1])
+    return 'system'
+
+
+@contextmanager
+def context(source, request=None, user=None):
+    """ Puts the changes recorded within down to source, and to the user of
+    request (looked up when each change is recorded, as the API only
+    authenticates in the view) or else user. A source of None is taken from
+    request: 'admin' or 'api' """
+    previous = getattr(_local, 'context', None)
+    _local.context = (source, request, user)
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+def _current():
+    """ The source, request description and user of the current context """
+    source, request, user = getattr(_local, 'context', None) or (_default_source(), None, None)
+    description = ''
+    if request is not None:
+        user = getattr(request, 'user', None)
+        description = '{} {}'.format(request.method, request.path)[:200]
+        match = request.resolver_match
+        if source is None:
+            source = 'admin' if match is not None and match.app_name == 'admin' else 'api'
+    if user is not None and not user.is_authenticated:
+        user = None
+    return source, description, user
+
+
+def values(instance, fields):
+    """ The values of the named fields of a model instance, by attribute name """
+    return {
+        instance._meta.get_field(name).attname:
+        getattr(instance, instance._meta.get_field(name).attname)
+        for name in fields
+    }
+
+
+def record(model, object_id, action, before, after):
+    """ Notes a change ('create', 'update', 'delete' or 'repair') to the
+    model instance with primary key object_id, with dicts of the values
+    before and after. It is queued when the current database transaction
+    commits, and dropped if it rolls back """
+    if not getattr(settings, 'AUDIT_LOG_ENABLED', True):
+        return
+    source, description, user = _current()
+    entry = {
+        'time': timezone.now(),
+        'source': source,
+        'request': description,
+        'user_id': user.pk if user is not None else None,
+        'username': user.get_username() if user is not None else '',
+        'model': model._meta.label,
+        'object_id': str(object_id),
+        'action': action,
+        'before': before,
+        'after': after,
+    }
+    transaction.on_commit(lambda: _get_writer().put(entry))
+
+
+def flush():
+    """ Waits until everything queued so far has been written """
+    writer = _writer
+    if writer is not None and writer.pid == os.getpid():
+        writer.flush()
+
+
+def stop():
+    """ Writes everything queued and stops the writer. The next change
+    recorded starts a new one, with a new database connection """
+    global _writer #pylint: disable=W0603,C0103
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.pid == os.getpid():
+        writer.stop()
+
+
+class AuditWriter(threading.Thread):
+    """ Writes queued entries to AuditEntry in batches of up to
+    settings.AUDIT_LOG_BATCH_SIZE, at least every
+    settings.AUDIT_LOG_FLUSH_INTERVAL_SECONDS """
+    # Attempts at writing a batch before its entries are logged instead
+    WRITE_ATTEMPTS = 3
+
+    def __init__(self):
+        super().__init__(name='audit-writer', daemon=True)
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+
+    def put(self, entry):
+        """ Queues entry for writing """
+        self.queue.put(entry)
+
+    def flush(self):
+        """ Waits until everything queued so far has been written """
+        self.queue.join()
+
+    def stop(self):
+        """ Writes what is left in the queue and stops the thread """
+        self.stopped.set()
+        # Wakes the thread rather than leave it waiting out the interval
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        batch = []
+        try:
+            while not (self.stopped.is_set() and self.queue.empty()):
+                try:
+                    entry = self.queue.get(
+                        timeout=getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL_SECONDS', 1)
+                    )
+                    if entry is None:
+                        self.queue.task_done()
+                    else:
+                        batch.append(entry)
+                except queue.Empty:
+                    pass
+                if batch and (self.queue.empty() or
+                              len(batch) >= getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 500)):
+                    # Connections are kept for CONN_MAX_AGE, as between requests
+                    connection.close_if_unusable_or_obsolete()
+                    self._write(batch)
+                    for _ in batch:
+                        self.queue.task_done()
+                    batch = []
+        finally:
+            connection.close()
+
+    def _write(self, batch):
+        """ Inserts the batch, retrying a few times. If it still can't be
+        written the entries are logged rather than lost silently """
+        from .models import AuditEntry, write_atomically
+        entries = [
+            AuditEntry(**dict(
+                entry,
+                before=None if entry['before'] is None else
+                json.dumps(entry['before'], cls=DjangoJSONEncoder),
+                after=None if entry['after'] is None else
+                json.dumps(entry['after'], cls=DjangoJSONEncoder),
+            ))
+            for entry in batch
+        ]
+        for attempt in range(1, self.WRITE_ATTEMPTS + 1):
+            try:
+                write_atomically(lambda: AuditEntry.objects.bulk_create(entries))
+                return
+            except Exception: #pylint: disable=W0703
+                logger.exception(
+                    'Writing %s audit entries failed, attempt %s', len(entries), attempt
+                )
+                connection.close()
+                if self.stopped.wait(attempt):
+                    break
+        for entry in batch:
+            logger.error('Unwritten audit entry: %s', json.dumps(entry, cls=DjangoJSONEncoder))
+
+
+def _get_writer():
+    """ The running AuditWriter of this process, started if need be """
+    global _writer #pylint: disable=W0603,C0103
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = AuditWriter()
+            _writer.start()
+            atexit.register(_writer.stop)
+        return _writer
+
+
+class AuditContextMiddleware:
+    """ Puts the changes made while handling a request down to its user,
+    through the admin or the API """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with context(None, request):
+            return self.get_response(request)
@@ -0,0 +1,88 @@
+""" Read-through cache of current and historical Account balances
+
+Entries live in the Django cache named by settings.BALANCE_CACHE_ALIAS
+(defaulting to 'default'). Every key includes a per-account version that
+invalidate() bumps when a write is made and again once it is committed, so
+a reader that loaded a balance before the commit can only store it under an
+old, unreachable version. The default local-memory backend is per process: deployments
+running several processes should point the alias at a shared backend, as
+settings_production does (or else at the dummy backend, turning caching off).
+"""
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _cache():
+    return caches[getattr(settings, 'BALANCE_CACHE_ALIAS', 'default')]
+
+
+def _version_key(account_id):
+    return 'fintech:balance-version:{}'.format(account_id)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _version(cache, account_id):
+    """ The current version of the Account's entries, starting a new one
+    (unlike any previous) if the cache has lost it """
+    version = cache.get(_version_key(account_id))
+    if version is None:
+        cache.add(_version_key(account_id), int(time.time() * 1000000), None)
+        version = cache.get(_version_key(account_id))
+    return version
+
+
+def get_or_load(account_id, date, load):
+    """ Returns what is cached for the balance of the Account, at the close
+    of date if it isn't None. On a miss it is taken from load() and stored,
+    so load() may return the balance along with anything derived from the
+    same read """
+    try:
+        account_id = uuid.UUID(str(account_id))
+    except ValueError:
+        # Not an Account we could have cached, let load() deal with it
+        return load()
+
+    cache = _cache()
+    key = 'fintech:balance:{}:{}:{}'.format(
+        account_id, _version(cache, account_id), date.isoformat() if date else 'current'
+    )
+    balance = cache.get(key)
+    if balance is not None:
+        _count('hits')
+        return balance
+    _count('misses')
+    balance = load()
+    cache.set(key, balance)
+    return balance
+
+
+def invalidate(account_id):
+    """ Drops every cached balance of the Account, both now and once the
+    current database transaction commits, so that nothing read in between
+    survives the commit """
+    def bump_version():
+        try:
+            _cache().incr(_version_key(account_id))
+        except ValueError:
+            # No version, so nothing cached for the account
+            pass
+    _count('invalidations')
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+def stats():
+    """ Hit, miss and invalidation counters since the process started """
+    with _stats_lock:
+        return dict(_stats)
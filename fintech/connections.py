@@ -0,0 +1,38 @@
+""" Set up of new database connections
+
+SQLite settings such as the journal mode are pragmas set on each connection
+rather than connection parameters, so apply_sqlite_pragmas runs them from
+settings.SQLITE_PRAGMAS whenever a connection is opened.
+"""
+import re
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# SQLite's own defaults, to go back to on a database that was put in WAL mode
+SQLITE_DEFAULT_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'mmap_size': 0}
+
+# Those of settings_production: readers don't block the writer and the
+# writer doesn't block readers, commits only sync the log at checkpoints,
+# and reads come straight from the memory mapped file
+SQLITE_WAL_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs): #pylint: disable=W0613
+    """ connection_created receiver running settings.SQLITE_PRAGMAS on new SQLite connections """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            # Pragmas can't be passed as query parameters
+            if not name.isidentifier() or not _PRAGMA_VALUE.match(str(value)):
+                raise ImproperlyConfigured('Invalid SQLite pragma {}={}'.format(name, value))
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
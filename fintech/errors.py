@@ -3,3 +3,16 @@
 class AccountBalanceError(Exception):
     """ An error to indicate somethings up with the Account balance """
     pass
+
+
+class BatchAccountBalanceError(AccountBalanceError):
+    """ An AccountBalanceError caused by one entry in a batch of Transactions """
+    def __init__(self, message, index):
+        super().__init__(message)
+        self.index = index
+
+
+class JournalEntryError(Exception):
+    """ An error to indicate a JournalEntry doesn't balance, or a change that
+    would unbalance one """
+    pass
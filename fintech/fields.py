@@ -0,0 +1,58 @@
+""" Model fields for the fintech app """
+from decimal import Decimal
+from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Cast
+
+
+def to_minor_units(value, decimal_places=2):
+    """ The amount as an integer number of minor units (cents), rounded to
+    decimal_places like a DecimalField would """
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(Decimal(1).scaleb(-decimal_places)).scaleb(decimal_places))
+
+
+def from_minor_units(value, decimal_places=2):
+    """ The amount for an integer number of minor units (cents) """
+    return Decimal(value).scaleb(-decimal_places)
+
+
+def add_minor_units(field_name, minor_units):
+    """ An update expression adding an integer number of minor units (cents)
+    to the MinorUnitDecimalField field_name. Both sides are typed as the
+    bigint stored, so the addition is integer arithmetic in the database
+    and minor_units isn't converted as an amount """
+    return Cast(field_name, models.BigIntegerField()) + \
+        Value(minor_units, output_field=models.BigIntegerField())
+
+
+class MinorUnitDecimalField(models.DecimalField):
+    """
+    A DecimalField stored as a 64-bit integer number of minor units.
+
+    Model instances, forms and serializers see a Decimal with decimal_places
+    places, exactly as with a DecimalField, while the database holds
+    value * 10 ** decimal_places in a bigint column, so sums and
+    comparisons there are exact integer arithmetic. Use add_minor_units to
+    change a stored value by a number of minor units in an update.
+    """
+    def get_internal_type(self):
+        return 'BigIntegerField'
+
+    def from_db_value(self, value, expression, connection): #pylint: disable=W0613
+        """ Minor units from the database to a Decimal """
+        if value is None:
+            return value
+        return from_minor_units(value, self.decimal_places)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        """ A Decimal (or anything to_python takes) to minor units """
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return value
+        return to_minor_units(self.to_python(value), self.decimal_places)
+
+    def get_db_prep_save(self, value, connection):
+        return self.get_db_prep_value(value, connection)
@@ -0,0 +1,352 @@
+""" Benchmarks the hot paths of the accounts API """
+import base64
+import datetime
+import functools
+import json
+import time
+import django
+from django.contrib.auth.models import Permission, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment
+)
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from engineering_exercise.row_serializers import RowSerializer
+from engineering_exercise.views import TransactionSerializer
+from fintech import audit
+from fintech.models import Account, ApiToken
+from .populate_sample_data import populate_customers
+
+
+def _percentile(sorted_values, percent):
+    """ Nearest-rank percentile of an already sorted list """
+    index = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def _rows_fetched(queries):
+    """ Counts the rows returned by the captured SELECT queries by running them again """
+    rows = 0
+    with connection.cursor() as cursor:
+        for query in queries:
+            if query['sql'].startswith('SELECT'):
+                cursor.execute('SELECT COUNT(*) FROM ({}) AS benchmarked'.format(query['sql']))
+                rows += cursor.fetchone()[0]
+    return rows
+
+
+def _send_capturing_queries(send):
+    """ Returns the response to send() and the queries it made. Django
+    empties the query log at the start of each request, which would throw
+    CaptureQueriesContext's count out, so that is stopped meanwhile """
+    request_started.disconnect(reset_queries)
+    try:
+        with CaptureQueriesContext(connection) as context:
+            response = send()
+    finally:
+        request_started.connect(reset_queries)
+    return response, context.captured_queries
+
+
+def _endpoints(account):
+    """ The requests to benchmark as (name, method, url, data) """
+    balance_url = reverse('account-balance', args=(account.uuid,))
+    transactions_url = reverse('account-transactions', args=(account.uuid,))
+    history_count = account.transactions.count()
+    middle_date = account.transactions.order_by('transaction_date').values_list(
+        'transaction_date', flat=True
+    )[history_count // 2]
+    last_page = max(1, (history_count + 9) // 10)
+    new_transaction = {
+        'transaction_date': str(datetime.datetime.today().date()),
+        'amount': '0.01',
+        'description': 'Benchmark',
+    }
+    return [
+        ('balance', 'get', balance_url, {}),
+        ('balance_at_date', 'get', balance_url, {'date': str(middle_date)}),
+        ('transactions_first_page', 'get', transactions_url, {}),
+        ('transactions_last_page', 'get', transactions_url, {'page': last_page}),
+        ('transactions_cursor', 'get', transactions_url, {'pagination': 'cursor'}),
+        ('transactions_create', 'post', transactions_url, new_transaction),
+    ]
+
+
+def run_benchmarks(history_sizes, requests, seed='benchmark'):
+    """ Seeds an Account per history size in the current database and times
+    each endpoint against it. Returns a list of result dicts """
+    superuser = User.objects.create_superuser(
+        username='Benchmark superuser', email='', password=None
+    )
+    client = Client()
+    client.force_login(superuser)
+
+    results = []
+    for history_size in history_sizes:
+        populate_customers([history_size], {
+            'accounts_per_customer': 1,
+            'transactions_per_account': history_size,
+            'chunk_size': 5000,
+            'seed': seed,
+        })
+        account = Account.objects.get(user__username='Sample User {}'.format(history_size))
+
+        for name, method, url, data in _endpoints(account):
+            send = getattr(client, method)
+            # Query counts are measured on a separate request, as capturing
+            # queries slows the database cursor down
+            response, queries = _send_capturing_queries(lambda: send(url, data))
+            if response.status_code >= 300:
+                raise CommandError('{} returned {}'.format(name, response.status_code))
+
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                send(url, data)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+
+            results.append({
+                'endpoint': name,
+                'history_size': history_size,
+                'requests': requests,
+                'p50_ms': round(_percentile(timings, 50), 3),
+                'p95_ms': round(_percentile(timings, 95), 3),
+                'p99_ms': round(_percentile(timings, 99), 3),
+                'queries': len(queries),
+                'rows_fetched': _rows_fetched(queries),
+                'response_bytes': len(response.content),
+            })
+    return results
+
+
+def run_serializer_benchmarks(history_sizes, repeats):
+    """ Times fetching, serialising and rendering the whole history of each
+    Account seeded by run_benchmarks, through TransactionSerializer and
+    through RowSerializer. Returns a list of result dicts """
+    row_serializer = RowSerializer(TransactionSerializer)
+    renderer = JSONRenderer()
+    paths = [
+        ('model_serializer', lambda query: TransactionSerializer(query, many=True).data),
+        ('row_serializer', lambda query: row_serializer.serialize(row_serializer.values(query))),
+    ]
+
+    results = []
+    for history_size in history_sizes:
+        query = Account.objects.get(
+            user__username='Sample User {}'.format(history_size)
+        ).transactions.order_by('-create_time', '-transaction_date')
+        for name, serialize in paths:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                content = renderer.render(serialize(query.all()))
+            elapsed = time.perf_counter() - start
+            results.append({
+                'serializer': name,
+                'history_size': history_size,
+                'repeats': repeats,
+                'rows_per_sec': round(history_size * repeats / elapsed),
+                'response_bytes': len(content),
+            })
+    return results
+
+
+def run_audit_benchmark(requests):
+    """ Times creating Transactions through the API with the audit log off
+    and on, alternately so that both see the same database, and times
+    audit.record on its own. Returns a result dict """
+    superuser = User.objects.create_superuser(
+        username='Audit benchmark superuser', email='', password=None
+    )
+    client = Client()
+    client.force_login(superuser)
+    account = Account.objects.create(user=superuser, name='Audit benchmark', balance=0)
+    url = reverse('account-transactions', args=(account.uuid,))
+    data = {
+        'transaction_date': str(datetime.datetime.today().date()),
+        'amount': '0.01',
+        'description': 'Audit benchmark',
+    }
+
+    timings = {False: [], True: []}
+    for i in range(2 * requests):
+        enabled = bool(i % 2)
+        with override_settings(AUDIT_LOG_ENABLED=enabled):
+            start = time.perf_counter()
+            response = client.post(url, data)
+            timings[enabled].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 300:
+            raise CommandError('transactions_create returned {}'.format(response.status_code))
+    for values in timings.values():
+        values.sort()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        audit.record(Account, account.pk, 'update', {'name': 'Before'}, {'name': 'After'})
+    record_ms = (time.perf_counter() - start) * 1000 / requests
+    # Nothing may be left writing to the database once it is destroyed
+    audit.flush()
+    return {
+        'requests': requests,
+        'off_p50_ms': round(_percentile(timings[False], 50), 3),
+        'on_p50_ms': round(_percentile(timings[True], 50), 3),
+        'added_p50_ms': round(_percentile(timings[True], 50) - _percentile(timings[False], 50), 3),
+        'record_ms': round(record_ms, 4),
+    }
+
+
+def run_auth_benchmark(requests):
+    """ Times reading a balance and creating a Transaction as a staff User
+    with model permissions, authenticating with basic authentication and
+    with an API token, whose cache is warm after the first request. Counts
+    the queries on the auth tables too. Returns a list of result dicts """
+    user = User.objects.create_user(
+        username='Auth benchmark user', password='benchmark', is_staff=True
+    )
+    user.user_permissions.set(Permission.objects.filter(
+        content_type__app_label='fintech', codename__in=('add_account', 'view_account')
+    ))
+    account = Account.objects.create(user=user, name='Auth benchmark', balance=0)
+    _, key = ApiToken.create_token(user, 'Benchmark')
+    credentials = [
+        ('basic', 'Basic {}'.format(base64.b64encode(b'Auth benchmark user:benchmark').decode())),
+        ('token', 'Token {}'.format(key)),
+    ]
+    endpoints = [
+        ('balance', 'get', reverse('account-balance', args=(account.uuid,)), {}),
+        ('transactions_create', 'post', reverse('account-transactions', args=(account.uuid,)), {
+            'transaction_date': str(datetime.datetime.today().date()),
+            'amount': '0.01',
+            'description': 'Auth benchmark',
+        }),
+    ]
+
+    client = Client()
+    results = []
+    for name, method, url, data in endpoints:
+        for scheme, authorization in credentials:
+            send = functools.partial(
+                getattr(client, method), url, data, HTTP_AUTHORIZATION=authorization
+            )
+            send()
+            response, queries = _send_capturing_queries(send)
+            if response.status_code >= 300:
+                raise CommandError('{} with {} returned {}'.format(
+                    name, scheme, response.status_code
+                ))
+
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                send()
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results.append({
+                'endpoint': name,
+                'auth': scheme,
+                'requests': requests,
+                'p50_ms': round(_percentile(timings, 50), 3),
+                'p95_ms': round(_percentile(timings, 95), 3),
+                'queries': len(queries),
+                'auth_queries': sum('"auth_' in query['sql'] for query in queries),
+            })
+    return results
+
+
+class Command(BaseCommand):
+    """ Benchmarks the hot paths of the accounts API """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--history_sizes',
+            type=int,
+            nargs='+',
+            help='The number of transactions on each benchmarked account. '
+                 'Defaults to 10 1000 10000',
+            default=[10, 1000, 10000],
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            help='The number of timed requests per endpoint. Defaults to 100',
+            default=100,
+        )
+        parser.add_argument(
+            '--serializer_repeats',
+            type=int,
+            help='The number of times each history is serialised. Defaults to 10',
+            default=10,
+        )
+        parser.add_argument(
+            '--seed',
+            help='Seed for the generated transactions',
+            default='benchmark',
+        )
+        parser.add_argument(
+            '-o',
+            '--output',
+            help='Write the results as JSON to this file, or - for stdout',
+            default=None,
+        )
+
+    def handle(self, *args, **options):
+        # Run against a throwaway test database rather than the real one
+        setup_test_environment()
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmarks(options['history_sizes'], options['requests'], options['seed'])
+            serializer_results = run_serializer_benchmarks(
+                options['history_sizes'], options['serializer_repeats']
+            )
+            audit_result = run_audit_benchmark(options['requests'])
+            auth_results = run_auth_benchmark(options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+            'serializers': serializer_results,
+            'audit': audit_result,
+            'auth': auth_results,
+        }
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        self.stdout.write('{:<26}{:>9}{:>10}{:>10}{:>10}{:>9}{:>9}'.format(
+            'endpoint', 'history', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'rows'
+        ))
+        for result in results:
+            self.stdout.write('{endpoint:<26}{history_size:>9}{p50_ms:>10.2f}{p95_ms:>10.2f}'
+                              '{p99_ms:>10.2f}{queries:>9}{rows_fetched:>9}'.format(**result))
+
+        self.stdout.write('\n{:<26}{:>9}{:>12}'.format('serializer', 'history', 'rows/sec'))
+        for result in serializer_results:
+            self.stdout.write(
+                '{serializer:<26}{history_size:>9}{rows_per_sec:>12}'.format(**result)
+            )
+
+        self.stdout.write(
+            '\nAudit log: transactions_create p50 {off_p50_ms:.2f} ms off, {on_p50_ms:.2f} ms on '
+            '({added_p50_ms:+.2f} ms), audit.record {record_ms:.4f} ms'.format(**audit_result)
+        )
+
+        self.stdout.write('\n{:<26}{:>7}{:>10}{:>10}{:>9}{:>14}'.format(
+            'endpoint', 'auth', 'p50 ms', 'p95 ms', 'queries', 'auth queries'
+        ))
+        for result in auth_results:
+            self.stdout.write('{endpoint:<26}{auth:>7}{p50_ms:>10.2f}{p95_ms:>10.2f}'
+                              '{queries:>9}{auth_queries:>14}'.format(**result))
@@ -0,0 +1,22 @@
+""" Creates an API token for a user """
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from fintech.models import ApiToken
+
+
+class Command(BaseCommand):
+    """ Creates an ApiToken for a User and prints its key, which can't be
+    shown again. Tokens are revoked in the admin """
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='The user the token authenticates as')
+        parser.add_argument('name', help='Who or what the token is given to')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('No user {}'.format(options['username']))
+        _, key = ApiToken.create_token(user, options['name'])
+        self.stdout.write(key)
@@ -0,0 +1,152 @@
+""" Load tests an endpoint of a running server """
+import base64
+import http.client
+import socket
+import threading
+import time
+import urllib.parse
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_api import _percentile
+
+SLOW_CLIENT_INTERVAL_SECONDS = 0.5
+
+
+class SlowClient(threading.Thread):
+    """ Holds a connection open by sending a request a byte at a time, as a
+    client on a poor network would, until stopped """
+    def __init__(self, host, port, path):
+        super().__init__(daemon=True)
+        self.address = (host, port)
+        self.request = 'GET {} HTTP/1.1\r\nHost: {}\r\n'.format(path, host).encode()
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            with socket.create_connection(self.address) as sock:
+                for byte in self.request:
+                    sock.sendall(bytes([byte]))
+                    if self.stopped.wait(SLOW_CLIENT_INTERVAL_SECONDS):
+                        return
+                while not self.stopped.wait(SLOW_CLIENT_INTERVAL_SECONDS):
+                    sock.sendall(b'X-Slow: 1\r\n')
+        except OSError:
+            # The server gave up on us, which is fair enough
+            pass
+
+
+def run_load(url, concurrency, requests, headers):
+    """ Sends requests GETs for url from concurrency clients at once, each
+    on its own keep-alive connection. Returns (elapsed seconds, sorted
+    latencies in ms, error count) """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path + ('?' + parsed.query if parsed.query else '')
+    remaining = [requests]
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def client():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+        while True:
+            with lock:
+                if not remaining[0]:
+                    break
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                failed = True
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors[0] += failed
+        connection.close()
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies), errors[0]
+
+
+class Command(BaseCommand):
+    """ Load tests an endpoint of a running server, WSGI or ASGI """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url',
+            help='The URL to GET, e.g. http://127.0.0.1:8000/account/<uuid>/balance/',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            nargs='+',
+            help='The numbers of concurrent clients to test with. Defaults to 1 8 32',
+            default=[1, 8, 32],
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            help='The number of requests sent at each level of concurrency. Defaults to 500',
+            default=500,
+        )
+        parser.add_argument(
+            '--slow_clients',
+            type=int,
+            help='The number of slow clients holding connections open meanwhile. Defaults to 0',
+            default=0,
+        )
+        parser.add_argument(
+            '--header',
+            action='append',
+            help='A header to send, e.g. "Cookie: sessionid=...". May be repeated',
+            default=[],
+        )
+        parser.add_argument(
+            '--username',
+            help='Username for HTTP basic authentication. Note that checking the '
+                 'password takes a while, so it will dominate the timings',
+        )
+        parser.add_argument('--password', help='Password for HTTP basic authentication')
+
+    def handle(self, *args, **options):
+        parsed = urllib.parse.urlsplit(options['url'])
+        if parsed.scheme != 'http':
+            raise CommandError('Only http:// URLs are supported')
+        headers = {}
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+        if options['username']:
+            credentials = '{}:{}'.format(options['username'], options['password'] or '')
+            headers['Authorization'] = 'Basic {}'.format(
+                base64.b64encode(credentials.encode()).decode()
+            )
+
+        slow_clients = [
+            SlowClient(parsed.hostname, parsed.port or 80, parsed.path)
+            for _ in range(options['slow_clients'])
+        ]
+        for slow_client in slow_clients:
+            slow_client.start()
+        try:
+            self.stdout.write('{:>12}{:>10}{:>10}{:>10}{:>10}{:>8}'.format(
+                'concurrency', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'
+            ))
+            for concurrency in options['concurrency']:
+                elapsed, latencies, errors = run_load(
+                    options['url'], concurrency, options['requests'], headers
+                )
+                self.stdout.write('{:>12}{:>10.1f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8}'.format(
+                    concurrency, len(latencies) / elapsed, _percentile(latencies, 50),
+                    _percentile(latencies, 95), _percentile(latencies, 99), errors
+                ))
+        finally:
+            for slow_client in slow_clients:
+                slow_client.stopped.set()
@@ -1,14 +1,106 @@
 """ Handles the population of sample data """
+import argparse
 import datetime
+import functools
+import multiprocessing
 import random
-from decimal import Decimal
+import time
 from django.contrib.auth.models import User
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
 
-from fintech.models import Account, Transaction
+from fintech.fields import from_minor_units
+from fintech.models import Account, DailyBalance, Transaction
 
 MAX_TRANSACTION_AGE_DAYS = 365
+PROGRESS_INTERVAL_SECONDS = 5
+
+
+def positive_int(value):
+    """ argparse type for the counts, which have no upper limit """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} is not a positive integer'.format(value))
+    return number
+
+
+def _generate_transaction_date(rng, index, days_interval):
+    # Puts a bit of noise in the transaction date, keeping dates in index order
+    day_fuzz = rng.uniform(0, days_interval)
+    day_delta = MAX_TRANSACTION_AGE_DAYS - int((days_interval * index) + day_fuzz)
+    transaction_date = datetime.datetime.today().date() - \
+        datetime.timedelta(days=day_delta)
+    return transaction_date
+
+
+def populate_customers(customer_indices, options):
+    """ Creates the Users, Accounts, Transactions and DailyBalances for the
+    given customer indices, returning the number of Transactions created.
+    Rows are inserted with bulk_create in chunks, so Transaction.save and its
+    balance checks are bypassed; balances are worked out here instead. At
+    most chunk_size Transactions are held in memory, however long an
+    Account's history """
+    days_interval = MAX_TRANSACTION_AGE_DAYS / options['transactions_per_account']
+    transactions, daily_balances = [], []
+    created = 0
+
+    def flush():
+        # bulk_create splits the chunk into the largest batches the database allows
+        Transaction.objects.bulk_create(transactions)
+        DailyBalance.objects.bulk_create(daily_balances)
+        del transactions[:]
+        del daily_balances[:]
+
+    with transaction.atomic():
+        for i in customer_indices:
+            # Seeded per customer so the data doesn't depend on the number of processes
+            rng = random.Random('{}-{}'.format(options['seed'], i)) \
+                if options['seed'] is not None else random.Random()
+            user = User.objects.create(username='Sample User {}'.format(i))
+
+            for j in range(options['accounts_per_customer']):
+                # Inserted first, so its Transactions can be written as they are made
+                account = Account(user=user, name='Sample Account {}'.format(j), balance=0)
+                Account.objects.bulk_create([account])
+                running_balance = 0
+                day = None
+
+                for k in range(options['transactions_per_account']):
+                    transaction_date = _generate_transaction_date(rng, k, days_interval)
+                    # Dates come in order, so a new one closes the previous day
+                    if day is not None and transaction_date != day:
+                        daily_balances.append(DailyBalance(
+                            account=account, date=day, balance=from_minor_units(running_balance)
+                        ))
+                    day = transaction_date
+
+                    # And into the amount, in cents
+                    transaction_amount = rng.randint(1, 100001)
+                    if running_balance > transaction_amount:
+                        # Will throw in some negative transactions if possible
+                        transaction_amount = transaction_amount * -1
+                    running_balance += transaction_amount
+
+                    transactions.append(Transaction(
+                        account=account,
+                        transaction_date=transaction_date,
+                        amount=from_minor_units(transaction_amount),
+                        active=True,
+                        description='Sample Transaction {}'.format(k),
+                    ))
+                    if len(transactions) >= options['chunk_size']:
+                        flush()
+
+                daily_balances.append(DailyBalance(
+                    account=account, date=day, balance=from_minor_units(running_balance)
+                ))
+                Account.objects.filter(pk=account.pk).update(
+                    balance=from_minor_units(running_balance)
+                )
+                created += options['transactions_per_account']
+        flush()
+    return created
+
 
 class Command(BaseCommand):
     """ Handles the population of sample data """
@@ -17,71 +109,93 @@ class Command(BaseCommand):
         parser.add_argument(
             '-c',
             '--number_customers',
-            type=int,
+            type=positive_int,
             help='The number of customers to create. Defaults to 10',
-            metavar='[1-100]',
-            choices=range(1, 101),
             default=10,
         )
         parser.add_argument(
             '-a',
             '--accounts_per_customer',
-            type=int,
+            type=positive_int,
             help='The number of accounts per customer to create. Defaults to 2',
-            metavar='[1-5]',
-            choices=range(1, 6),
             default=2,
         )
         parser.add_argument(
             '-t',
             '--transactions_per_account',
-            type=int,
+            type=positive_int,
             help='The number of transactions per account to create. Defaults to 5',
-            metavar='[1-50]',
-            choices=range(1, 51),
             default=5,
         )
+        parser.add_argument(
+            '--chunk_size',
+            type=positive_int,
+            help='The number of transactions written per bulk_create. Defaults to 5000',
+            default=5000,
+        )
+        parser.add_argument(
+            '--seed',
+            help='Seed for the random data, so runs can be reproduced',
+            default=None,
+        )
+        parser.add_argument(
+            '--processes',
+            type=positive_int,
+            help='The number of processes generating data. Defaults to 1',
+            default=1,
+        )
 
-    @staticmethod
-    def _generate_transaction_date(index, days_interval):
-        # Puts a bit of noise in the transaction date
-        day_fuzz = random.randint(0, days_interval)
-        day_delta = MAX_TRANSACTION_AGE_DAYS - ((days_interval * index) + day_fuzz)
-        transaction_date = datetime.datetime.today().date() - \
-            datetime.timedelta(days=day_delta)
-        return transaction_date
+    def _report_progress(self, created, total, start_time, verbosity):
+        if verbosity < 1:
+            return
+        elapsed = time.time() - start_time
+        self.stdout.write('{} of {} transactions created, {:.0f} rows/sec'.format(
+            created, total, created / elapsed if elapsed else 0
+        ))
 
     def handle(self, *args, **options):
-        days_interval = round(MAX_TRANSACTION_AGE_DAYS / options['transactions_per_account'])
-
-        with transaction.atomic():
-            for i in range(options['number_customers']):
-                user = User.objects.create(username='Sample User {}'.format(i))
-
-                for j in range(options['accounts_per_customer']):
-                    account = Account.objects.create(
-                        user=user,
-                        name='Sample Account {}'.format(j),
-                        balance=0
-                    )
-                    running_balance = 0
-
-                    for k in range(options['transactions_per_account']):
-                        transaction_date = self._generate_transaction_date(k, days_interval)
-
-                        # And into the amount
-                        transaction_amount = Decimal(random.randint(1, 100001)) / 100
-                        if running_balance > transaction_amount:
-                            # Will throw in some negative transactions if possible
-                            transaction_amount = transaction_amount * -1
-                        running_balance += transaction_amount
-
-                        Transaction.objects.create(
-                            account=account,
-                            transaction_date=transaction_date,
-                            amount=transaction_amount,
-                            active=True,
-                            description='Sample Transaction {}'.format(k),
-                        )
-
-        self.stdout.write('Objects created')
+        worker_options = {
+            key: options[key] for key in (
+                'accounts_per_customer', 'transactions_per_account', 'chunk_size', 'seed'
+            )
+        }
+        transactions_per_customer = \
+            options['accounts_per_customer'] * options['transactions_per_account']
+        total = options['number_customers'] * transactions_per_customer
+
+        # Each task holds roughly a chunk of transactions
+        customers_per_task = max(1, options['chunk_size'] // transactions_per_customer)
+        tasks = [
+            range(i, min(i + customers_per_task, options['number_customers']))
+            for i in range(0, options['number_customers'], customers_per_task)
+        ]
+        populate = functools.partial(populate_customers, options=worker_options)
+
+        pool = None
+        if options['processes'] > 1:
+            if connection.vendor == 'sqlite':
+                raise CommandError('SQLite only allows one writer at a time, use --processes 1')
+            # Forked workers must open their own database connections
+            connections.close_all()
+            pool = multiprocessing.Pool(options['processes'])
+            results = pool.imap_unordered(populate, tasks)
+        else:
+            results = map(populate, tasks)
+
+        start_time = last_report_time = time.time()
+        created = 0
+        try:
+            for task_created in results:
+                created += task_created
+                if created < total and \
+                        time.time() - last_report_time > PROGRESS_INTERVAL_SECONDS:
+                    self._report_progress(created, total, start_time, options['verbosity'])
+                    last_report_time = time.time()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self._report_progress(created, total, start_time, options['verbosity'])
+        if options['verbosity'] >= 1:
+            self.stdout.write('Objects created')
@@ -0,0 +1,16 @@
+""" Removes expired Idempotency-Keys """
+from django.core.management.base import BaseCommand
+
+from fintech.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """ Removes the Idempotency-Keys older than
+    settings.IDEMPOTENCY_KEY_TTL_SECONDS, keeping the table bounded. Run it
+    regularly, e.g. from cron """
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(
+            create_time__lt=IdempotencyKey.expiry_cutoff()
+        ).delete()
+        self.stdout.write('{} expired idempotency keys removed'.format(deleted))
@@ -0,0 +1,158 @@
+""" Checks every Account balance against its Transactions """
+import functools
+import json
+import multiprocessing
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+from fintech import audit
+from fintech.models import Account
+from .populate_sample_data import PROGRESS_INTERVAL_SECONDS, positive_int
+
+
+def _account_chunks(after, chunk_size):
+    """ Yields the pks of the Accounts after the given pk, in pk order and
+    chunk_size at a time """
+    while True:
+        query = Account.objects.order_by('pk').values_list('pk', flat=True)
+        if after is not None:
+            query = query.filter(pk__gt=after)
+        account_ids = list(query[:chunk_size])
+        if not account_ids:
+            return
+        yield account_ids
+        after = account_ids[-1]
+
+
+def reconcile_accounts(account_ids, repair):
+    """ Checks the Accounts against the invariants in the Account docstring
+    with one grouped query, repairing the balances that don't match their
+    Transactions if repair is set. Returns the last pk checked, the number of
+    Accounts checked and a list of (pk, balance, calculated balance, repaired)
+    for those that failed """
+    rows = Account.objects.filter(pk__in=account_ids).annotate(
+        calculated_balance=Coalesce(
+            Sum('transactions__amount', filter=Q(transactions__active=True)), 0
+        )
+    ).values_list('pk', 'balance', 'calculated_balance')
+    failed = [
+        (account_id, balance, calculated_balance)
+        for account_id, balance, calculated_balance in rows
+        if balance != calculated_balance or balance < 0
+    ]
+
+    repaired = {}
+    if repair and failed:
+        repaired = Account.update_balances([account_id for account_id, _, _ in failed])
+        # Pool workers exit without writing what is left in the audit queue
+        audit.flush()
+    return account_ids[-1], len(account_ids), [
+        (account_id, balance, calculated_balance, account_id in repaired)
+        for account_id, balance, calculated_balance in failed
+    ]
+
+
+class Command(BaseCommand):
+    """ Checks that each Account balance equals the sum of its active
+    Transactions and isn't below 0, optionally repairing those that don't match """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Set balances that do not match to the sum of their Transactions',
+        )
+        parser.add_argument(
+            '--chunk_size',
+            type=positive_int,
+            help='The number of accounts checked per query. Defaults to 1000',
+            default=1000,
+        )
+        parser.add_argument(
+            '--processes',
+            type=positive_int,
+            help='The number of processes checking accounts. Defaults to 1',
+            default=1,
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Record progress in this file, and resume from it if it exists. '
+                 'It is removed once every account has been checked',
+            default=None,
+        )
+
+    def _read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return {'after': None, 'checked': 0, 'failed': 0, 'repaired': 0}
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        self.stdout.write('Resuming after account {after}, {checked} checked so far'.format(
+            **checkpoint
+        ))
+        return checkpoint
+
+    @staticmethod
+    def _write_checkpoint(path, checkpoint):
+        # Written to one side first, so an interruption can't leave half a file
+        with open(path + '.tmp', 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        checkpoint = self._read_checkpoint(options['checkpoint'])
+        chunks = _account_chunks(checkpoint['after'], options['chunk_size'])
+        reconcile = functools.partial(reconcile_accounts, repair=options['repair'])
+
+        pool = None
+        if options['processes'] > 1:
+            if connection.vendor == 'sqlite' and options['repair']:
+                raise CommandError(
+                    'SQLite only allows one writer at a time, use --processes 1 with --repair'
+                )
+            # Forked workers must open their own database connections
+            connections.close_all()
+            pool = multiprocessing.Pool(options['processes'])
+            # In order, so that the checkpoint only ever covers finished chunks
+            results = pool.imap(reconcile, chunks)
+        else:
+            results = map(reconcile, chunks)
+
+        start_time = last_report_time = time.time()
+        try:
+            for last_account_id, checked, failed in results:
+                for account_id, balance, calculated_balance, repaired in failed:
+                    self.stdout.write(
+                        'Account {}: balance {}, active transactions sum to {}{}'.format(
+                            account_id, balance, calculated_balance,
+                            ', repaired' if repaired else ''
+                        )
+                    )
+                checkpoint['after'] = str(last_account_id)
+                checkpoint['checked'] += checked
+                checkpoint['failed'] += len(failed)
+                checkpoint['repaired'] += sum(repaired for _, _, _, repaired in failed)
+                if options['checkpoint']:
+                    self._write_checkpoint(options['checkpoint'], checkpoint)
+                if time.time() - last_report_time > PROGRESS_INTERVAL_SECONDS:
+                    self.stdout.write('{} accounts checked, {:.0f} accounts/sec'.format(
+                        checkpoint['checked'], checkpoint['checked'] / (time.time() - start_time)
+                    ))
+                    last_report_time = time.time()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if options['checkpoint'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        self.stdout.write('{checked} accounts checked, {failed} failed, {repaired} repaired'.format(
+            **checkpoint
+        ))
+        if checkpoint['failed'] > checkpoint['repaired']:
+            raise CommandError('{} accounts do not match their transactions'.format(
+                checkpoint['failed'] - checkpoint['repaired']
+            ))
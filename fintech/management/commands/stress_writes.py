@@ -0,0 +1,305 @@
+""" Stress tests concurrent writes to Account balances """
+import datetime
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment
+)
+
+from fintech import audit
+from fintech.connections import SQLITE_DEFAULT_PRAGMAS, SQLITE_WAL_PRAGMAS
+from fintech.errors import AccountBalanceError
+from fintech.models import Account, DailyBalance, JournalEntry, Transaction
+from .populate_sample_data import positive_int
+from .reconcile_balances import reconcile_accounts
+
+OPENING_BALANCE = Decimal('100.00')
+MAX_TRANSACTION_AGE_DAYS = 30
+
+
+def _write_transactions(args):
+    """ Saves writes Transactions one at a time on Accounts picked from
+    account_ids, mostly withdrawals so that many are refused. Returns the
+    number saved and the number refused for want of balance """
+    account_ids, writes, seed = args
+    rng = random.Random(seed)
+    today = datetime.datetime.today().date()
+    saved = refused = 0
+    try:
+        for _ in range(writes):
+            try:
+                Transaction.objects.create(
+                    account_id=rng.choice(account_ids),
+                    transaction_date=today - datetime.timedelta(
+                        days=rng.randint(0, MAX_TRANSACTION_AGE_DAYS)
+                    ),
+                    amount=Decimal(rng.randint(-3000, 2000)) / 100,
+                    active=rng.random() > 0.1,
+                )
+                saved += 1
+            except AccountBalanceError:
+                refused += 1
+    finally:
+        audit.flush()
+        connections.close_all()
+    return saved, refused
+
+
+def _post_transfers(args):
+    """ Posts writes transfers between random pairs of Accounts from
+    account_ids, one JournalEntry at a time. Returns the number posted and
+    the number refused for want of balance """
+    account_ids, writes, seed = args
+    rng = random.Random(seed)
+    today = datetime.datetime.today().date()
+    posted = refused = 0
+    try:
+        for _ in range(writes):
+            from_account_id, to_account_id = rng.sample(account_ids, 2)
+            try:
+                JournalEntry.transfer(
+                    from_account_id, to_account_id, Decimal(rng.randint(1, 3000)) / 100,
+                    today - datetime.timedelta(days=rng.randint(0, MAX_TRANSACTION_AGE_DAYS)),
+                    'Stress transfer'
+                )
+                posted += 1
+            except AccountBalanceError:
+                refused += 1
+    finally:
+        audit.flush()
+        connections.close_all()
+    return posted, refused
+
+
+def _run_workers(target, tasks, processes):
+    """ Calls target with each of tasks at once, in threads or processes.
+    Returns the results and the seconds taken """
+    start = time.perf_counter()
+    if processes:
+        # Forked workers must open their own database connections
+        connections.close_all()
+        with multiprocessing.Pool(len(tasks)) as pool:
+            results = pool.map(target, tasks)
+    else:
+        results = [None] * len(tasks)
+
+        def work(index):
+            results[index] = target(tasks[index])
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(len(tasks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if None in results:
+            raise CommandError('A writer failed')
+    return results, time.perf_counter() - start
+
+
+def _check_accounts(account_ids):
+    """ The pks of the Accounts failing the invariants in the Account
+    docstring, and of those whose latest DailyBalance isn't their balance """
+    _, _, failed = reconcile_accounts(account_ids, repair=False)
+    today = datetime.datetime.today().date()
+    failed_snapshots = [
+        account.pk for account in Account.objects.filter(pk__in=account_ids)
+        if DailyBalance.balance_at(account.pk, today) != account.balance
+    ]
+    return [account_id for account_id, _, _, _ in failed], failed_snapshots
+
+
+def _create_accounts(count, prefix):
+    """ Creates count Accounts with OPENING_BALANCE in them, returning their pks """
+    user = User.objects.create(username='{} stress test'.format(prefix))
+    account_ids = []
+    for i in range(count):
+        account = Account.objects.create(user=user, name='Stress {}'.format(i), balance=0)
+        Transaction.objects.create(
+            account=account,
+            transaction_date=datetime.datetime.today().date() -
+            datetime.timedelta(days=MAX_TRANSACTION_AGE_DAYS),
+            amount=OPENING_BALANCE,
+            active=True,
+        )
+        account_ids.append(account.pk)
+    return account_ids
+
+
+def run_stress(workers, writes, same_account, processes=False, seed='stress'):
+    """ Has workers threads (or processes) save writes Transactions each at
+    once, all on one Account if same_account is set, otherwise each on an
+    Account of its own. Then checks the Accounts against the invariants in the
+    Account docstring and their DailyBalance snapshots against their
+    balances. Returns a dict of the results """
+    name = 'same_account' if same_account else 'cross_account'
+    account_ids = _create_accounts(1 if same_account else workers, name)
+    tasks = [
+        ([account_ids[0 if same_account else i]], writes, '{}-{}-{}'.format(seed, name, i))
+        for i in range(workers)
+    ]
+    counts, elapsed = _run_workers(_write_transactions, tasks, processes)
+
+    saved = sum(count[0] for count in counts)
+    failed, failed_snapshots = _check_accounts(account_ids)
+    return {
+        'name': name,
+        'workers': workers,
+        'writes': workers * writes,
+        'saved': saved,
+        'refused': sum(count[1] for count in counts),
+        'missing': len(account_ids) + saved -
+                   Transaction.objects.filter(account_id__in=account_ids).count(),
+        'failed': failed,
+        'failed_snapshots': failed_snapshots,
+        'writes_per_sec': workers * writes / elapsed,
+    }
+
+
+def run_transfer_stress(workers, writes, accounts, processes=False, seed='stress'):
+    """ Has workers threads (or processes) post writes transfers each at
+    once between random pairs of accounts Accounts, so that transfers in
+    opposite directions cross. Checks the invariants as run_stress does,
+    and that every transfer balanced and no money was made or lost.
+    Returns a dict of the results """
+    account_ids = _create_accounts(accounts, 'transfers')
+    tasks = [(account_ids, writes, '{}-transfers-{}'.format(seed, i)) for i in range(workers)]
+    counts, elapsed = _run_workers(_post_transfers, tasks, processes)
+
+    posted = sum(count[0] for count in counts)
+    failed, failed_snapshots = _check_accounts(account_ids)
+    legs = Transaction.objects.filter(account_id__in=account_ids, journal_entry__isnull=False)
+    unbalanced = legs.order_by().values('journal_entry').annotate(total=Sum('amount')).\
+        exclude(total=0).count()
+    total = Account.objects.filter(pk__in=account_ids).aggregate(total=Sum('balance'))['total']
+    return {
+        'name': 'transfers',
+        'workers': workers,
+        'writes': workers * writes,
+        'saved': posted,
+        'refused': sum(count[1] for count in counts),
+        'missing': 2 * posted - legs.count(),
+        'failed': failed,
+        'failed_snapshots': failed_snapshots,
+        'unbalanced': unbalanced,
+        'money_made': total - OPENING_BALANCE * accounts,
+        'writes_per_sec': workers * writes / elapsed,
+    }
+
+
+def _in_throwaway_database(run):
+    """ Returns run() against a new test database rather than the real one.
+    An in-memory SQLite database can't be shared between processes, and
+    locks differently to one on disk, so SQLite gets a temporary file """
+    setup_test_environment()
+    old_database_name = connection.settings_dict['NAME']
+    temporary_directory = None
+    if connection.vendor == 'sqlite':
+        temporary_directory = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            temporary_directory, 'stress.sqlite3'
+        )
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        return run()
+    finally:
+        audit.flush()
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+        if temporary_directory is not None:
+            shutil.rmtree(temporary_directory)
+
+
+class Command(BaseCommand):
+    """ Saves Transactions from many threads or processes at once, first all
+    on one Account and then each on its own, and then posts transfers
+    between a few Accounts, checking that no balance update is lost, none
+    goes below 0 and every transfer balances """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=positive_int,
+            help='The number of concurrent writers. Defaults to 8',
+            default=8,
+        )
+        parser.add_argument(
+            '--writes',
+            type=positive_int,
+            help='The number of Transactions each writer saves. Defaults to 100',
+            default=100,
+        )
+        parser.add_argument(
+            '--processes',
+            action='store_true',
+            help='Write from processes rather than threads',
+        )
+        parser.add_argument(
+            '--transfer_accounts',
+            type=positive_int,
+            help='The number of accounts transfers are made between. Defaults to 4',
+            default=4,
+        )
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help='On SQLite, run everything with SQLite\'s default journal and sync settings '
+                 'and then again with the WAL settings of settings_production',
+        )
+
+    @staticmethod
+    def _run_all(options):
+        """ The results of the same account, cross account and transfer runs """
+        results = [
+            run_stress(options['workers'], options['writes'], same_account, options['processes'])
+            for same_account in (True, False)
+        ]
+        results.append(run_transfer_stress(
+            options['workers'], options['writes'], options['transfer_accounts'],
+            options['processes']
+        ))
+        return results
+
+    def handle(self, *args, **options):
+        if options['transfer_accounts'] < 2:
+            raise CommandError('Transfers need at least 2 accounts')
+        profiles = [('', {})]
+        if options['compare']:
+            if connection.vendor != 'sqlite':
+                raise CommandError('--compare compares SQLite settings')
+            profiles = [
+                ('default', {'SQLITE_PRAGMAS': SQLITE_DEFAULT_PRAGMAS}),
+                ('wal', {'SQLITE_PRAGMAS': SQLITE_WAL_PRAGMAS}),
+            ]
+        results = []
+        for profile, profile_settings in profiles:
+            # New connections pick the pragmas up
+            connections.close_all()
+            with override_settings(**profile_settings):
+                results.extend(
+                    dict(result, name=' '.join(filter(None, (profile, result['name']))))
+                    for result in _in_throwaway_database(lambda: self._run_all(options))
+                )
+            connections.close_all()
+
+        self.stdout.write('{:>22}{:>9}{:>9}{:>9}{:>9}{:>9}{:>10}'.format(
+            'contention', 'writes', 'saved', 'refused', 'missing', 'failed', 'writes/s'
+        ))
+        for result in results:
+            self.stdout.write('{:>22}{:>9}{:>9}{:>9}{:>9}{:>9}{:>10.1f}'.format(
+                result['name'], result['writes'], result['saved'], result['refused'],
+                result['missing'], len(result['failed']) + len(result['failed_snapshots']) +
+                result.get('unbalanced', 0), result['writes_per_sec']
+            ))
+        if any(result['missing'] or result['failed'] or result['failed_snapshots'] or
+               result.get('unbalanced') or result.get('money_made')
+               for result in results):
+            raise CommandError('Concurrent writes broke the Account invariants')
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'active', 'amount'], name='fintech_tx_balance_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:19
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def populate_daily_balances(apps, schema_editor):
+    """ Builds the running end-of-day balances from the existing Transactions """
+    Transaction = apps.get_model('fintech', 'Transaction')
+    DailyBalance = apps.get_model('fintech', 'DailyBalance')
+    daily_totals = Transaction.objects.filter(active=True).\
+        values('account_id', 'transaction_date').annotate(total=Sum('amount')).\
+        order_by('account_id', 'transaction_date')
+
+    snapshots = []
+    account_id, balance = None, 0
+    for row in daily_totals.iterator():
+        if row['account_id'] != account_id:
+            account_id, balance = row['account_id'], 0
+        balance += row['total']
+        snapshots.append(DailyBalance(
+            account_id=account_id, date=row['transaction_date'], balance=balance
+        ))
+        if len(snapshots) >= 1000:
+            DailyBalance.objects.bulk_create(snapshots)
+            snapshots = []
+    DailyBalance.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0002_transaction_balance_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='fintech.Account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailybalance',
+            unique_together={('account', 'date')},
+        ),
+        migrations.RunPython(populate_daily_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0003_dailybalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-create_time', '-transaction_date', '-uuid'], name='fintech_tx_listing_idx'),
+        ),
+    ]
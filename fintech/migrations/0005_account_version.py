@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0004_transaction_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,73 @@
+""" Moves Account.balance, Transaction.amount and DailyBalance.balance from
+decimal columns to integer cents (MinorUnitDecimalField)
+
+Each column is copied into a new bigint column, which then takes its place.
+Reversing copies the cents back into a decimal column.
+"""
+from django.db import migrations, models
+
+import fintech.fields
+
+AMOUNT_FIELDS = (
+    ('account', 'balance', 'fintech_account'),
+    ('transaction', 'amount', 'fintech_transaction'),
+    ('dailybalance', 'balance', 'fintech_dailybalance'),
+)
+
+
+def to_minor_units_operations(model_name, name, table):
+    """ The operations replacing the decimal column name with integer cents """
+    minor_name = '{}_minor'.format(name)
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name=minor_name,
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name=model_name,
+            name=name,
+            field=models.DecimalField(decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.RunSQL(
+            ['UPDATE {} SET {} = ROUND({} * 100)'.format(table, minor_name, name)],
+            ['UPDATE {} SET {} = {} / 100.0'.format(table, name, minor_name)],
+        ),
+        migrations.RemoveField(
+            model_name=model_name,
+            name=name,
+        ),
+        migrations.RenameField(
+            model_name=model_name,
+            old_name=minor_name,
+            new_name=name,
+        ),
+        migrations.AlterField(
+            model_name=model_name,
+            name=name,
+            field=fintech.fields.MinorUnitDecimalField(decimal_places=2, max_digits=15),
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0005_account_version'),
+    ]
+
+    operations = [
+        # The index covers amount, so is rebuilt once the column is replaced
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='fintech_tx_balance_idx',
+        ),
+    ] + [
+        operation for model_name, name, table in AMOUNT_FIELDS
+        for operation in to_minor_units_operations(model_name, name, table)
+    ] + [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'active', 'amount'], name='fintech_tx_balance_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0006_minor_unit_amounts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='fintech_tx_balance_idx',
+        ),
+        migrations.AlterField(
+            model_name='account',
+            name='name',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'active', 'transaction_date', 'amount'], name='fintech_tx_balance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-transaction_date', '-create_time', '-uuid'], name='fintech_tx_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['description'], name='fintech_tx_description_idx'),
+        ),
+    ]
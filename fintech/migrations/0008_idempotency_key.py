@@ -0,0 +1,30 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0007_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('request_hash', models.CharField(max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('response', models.TextField()),
+                ('create_time', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='fintech.Account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('account', 'key')},
+        ),
+    ]
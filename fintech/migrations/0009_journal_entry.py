@@ -0,0 +1,32 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0008_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('transaction_date', models.DateField()),
+                ('description', models.CharField(blank=True, default='', max_length=20)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'journal entries',
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='journal_entry',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='legs', to='fintech.JournalEntry'),
+        ),
+    ]
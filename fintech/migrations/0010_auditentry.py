@@ -0,0 +1,36 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fintech', '0009_journal_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True)),
+                ('source', models.CharField(max_length=100)),
+                ('request', models.CharField(blank=True, default='', max_length=200)),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('username', models.CharField(blank=True, default='', max_length=150)),
+                ('model', models.CharField(max_length=50)),
+                ('object_id', models.CharField(max_length=64)),
+                ('action', models.CharField(max_length=10)),
+                ('before', models.TextField(blank=True, null=True)),
+                ('after', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'audit entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='auditentry',
+            index=models.Index(fields=['model', 'object_id', 'time'], name='fintech_audit_object_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1.3 on 2026-10-18 11:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fintech', '0010_auditentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Who or what the token was given to', max_length=100)),
+                ('key_prefix', models.CharField(editable=False, max_length=8)),
+                ('key_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('revoke_time', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
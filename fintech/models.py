@@ -1,8 +1,53 @@
 """ Models for the fintech app """
+import datetime
+import hashlib
+import random
+import secrets
+import time
 import uuid
-from django.db import models
+from decimal import Decimal
+from django.conf import settings
+from django.db import OperationalError, models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from .errors import AccountBalanceError
+from . import audit, balance_cache, token_cache
+from .errors import AccountBalanceError, BatchAccountBalanceError, JournalEntryError
+from .fields import MinorUnitDecimalField, add_minor_units, from_minor_units, to_minor_units
+
+# How many times a write that lost out to a concurrent one is attempted
+WRITE_ATTEMPTS = 5
+WRITE_RETRY_DELAY_SECONDS = 0.01
+
+
+def _is_write_conflict(err):
+    """ Whether err means the transaction collided with a concurrent writer,
+    and would likely succeed if tried again """
+    # PostgreSQL's serialization_failure and deadlock_detected
+    if getattr(err.__cause__, 'pgcode', None) in ('40001', '40P01'):
+        return True
+    # SQLite's "database is locked" and "database table is locked"
+    return 'is locked' in str(err)
+
+
+def write_atomically(write):
+    """ Calls write() in a database transaction and returns what it returns.
+    If the transaction collides with a concurrent writer it is rolled back
+    and tried again after a random, growing delay, up to WRITE_ATTEMPTS times.
+    Inside an outer transaction write() is only tried once, as only the
+    outer transaction as a whole could be tried again """
+    if transaction.get_connection().in_atomic_block:
+        with transaction.atomic():
+            return write()
+    for attempt in range(1, WRITE_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return write()
+        except OperationalError as err:
+            if attempt == WRITE_ATTEMPTS or not _is_write_conflict(err):
+                raise
+        time.sleep(random.uniform(0, WRITE_RETRY_DELAY_SECONDS * 2 ** attempt))
 
 
 class Account(models.Model):
@@ -15,24 +60,188 @@ class Account(models.Model):
            t.amount for t in account.transactions.all() if t.active
         )
         account.balance >= 0
+
+    Transaction.save and Transaction.delete keep the balance, and the
+    DailyBalance snapshots, up to date incrementally through
+    apply_balance_deltas. update_balance recalculates the balance from scratch.
+
+    version moves on with every change to the Account's balance or
+    Transactions, so it can be used to tell whether anything has changed.
+    balance and version are only ever updated in the database, never
+    through save().
+
+    Amounts are stored as integer cents by MinorUnitDecimalField, and the
+    balance arithmetic here is done in cents too, but they read and write as
+    Decimals.
     """
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    name = models.CharField(max_length=20)
-    balance = models.DecimalField(max_digits=15, decimal_places=2)
-    # TODO - decimals probably a bad idea - store int instead
+    name = models.CharField(max_length=20, db_index=True)
+    balance = MinorUnitDecimalField(max_digits=15, decimal_places=2)
     user = models.ForeignKey('auth.User', on_delete=models.PROTECT)
+    version = models.BigIntegerField(default=0, editable=False)
+
+    # What fintech.audit records of changes to an Account, by attribute name
+    AUDIT_FIELDS = ('user_id', 'name')
+
+    def save(self, *args, **kwargs): #pylint: disable=W0221
+        """ Leaves balance and version out of updates. They are only changed in
+        the database, and this copy of them may be out of date """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('balance', 'version')
+            ]
+        def write():
+            before = None
+            if not self._state.adding:
+                before = Account.objects.filter(pk=self.pk).values(*self.AUDIT_FIELDS).first()
+            result = super(Account, self).save(*args, **kwargs)
+            audit.record(
+                Account, self.pk, 'create' if before is None else 'update',
+                before, audit.values(self, self.AUDIT_FIELDS)
+            )
+            return result
+        return write_atomically(write)
+
+    def delete(self, *args, **kwargs): #pylint: disable=W0221
+        def write():
+            # The delete clears self.pk
+            account_id = self.pk
+            before = Account.objects.filter(pk=account_id).values(*self.AUDIT_FIELDS).first()
+            result = super(Account, self).delete(*args, **kwargs)
+            balance_cache.invalidate(account_id)
+            audit.record(Account, account_id, 'delete', before, None)
+            return result
+        return write_atomically(write)
 
     def update_balance(self):
         """ Refreshes the balance from calculated_balance """
-        if self.calculated_balance < 0:
-            raise AccountBalanceError('calculated_balance on account {} is below 0'.format(self))
-        self.balance = self.calculated_balance
-        self.save()
+        def write():
+            # Locked first, so no Transaction can change before the update
+            balance = Account.objects.select_for_update().filter(pk=self.pk).\
+                values_list('balance', flat=True).get()
+            calculated_balance = self.calculated_balance
+            if calculated_balance < 0:
+                raise AccountBalanceError(
+                    'calculated_balance on account {} is below 0'.format(self)
+                )
+            Account.objects.filter(pk=self.pk).update(
+                balance=calculated_balance, version=F('version') + 1
+            )
+            balance_cache.invalidate(self.pk)
+            if calculated_balance != balance:
+                audit.record(Account, self.pk, 'repair', {'balance': balance}, {
+                    'balance': calculated_balance
+                })
+            return calculated_balance
+        self.balance = write_atomically(write)
+
+    @classmethod
+    def update_balances(cls, account_ids):
+        """ update_balance for a batch of Accounts, summing their Transactions
+        in one grouped query. Accounts whose Transactions sum below 0 are left
+        as they are. Returns the new balances of the Accounts that changed,
+        keyed by pk """
+        def write():
+            updated = {}
+            balances = cls.objects.select_for_update().filter(pk__in=account_ids).\
+                order_by('pk').values_list('pk', 'balance')
+            calculated_balances = dict(
+                Transaction.objects.filter(account_id__in=account_ids, active=True).
+                order_by().values_list('account_id').annotate(balance=Sum('amount'))
+            )
+            for account_id, balance in balances:
+                calculated_balance = calculated_balances.get(account_id, from_minor_units(0))
+                if calculated_balance < 0 or calculated_balance == balance:
+                    continue
+                cls.objects.filter(pk=account_id).update(
+                    balance=calculated_balance, version=F('version') + 1
+                )
+                balance_cache.invalidate(account_id)
+                audit.record(
+                    cls, account_id, 'repair', {'balance': balance}, {'balance': calculated_balance}
+                )
+                updated[account_id] = calculated_balance
+            return updated
+        return write_atomically(write)
 
     @property
     def calculated_balance(self):
         """ Calculates the balance from active related Transactions """
-        return sum(x.amount for x in self.transactions.all() if x.active)
+        return self.transactions.filter(active=True).aggregate(
+            balance=Coalesce(Sum('amount'), 0)
+        )['balance']
+
+    def add_transactions(self, transactions):
+        """ Saves a batch of new Transactions on this Account in one go.
+        Taken in the given order, the running balance may not go below 0 at
+        any point, otherwise BatchAccountBalanceError is raised for the first
+        offending Transaction and nothing is saved. The balance and
+        DailyBalance snapshots are updated once for the whole batch """
+        if not transactions:
+            return []
+
+        def write():
+            balance = to_minor_units(Account.objects.select_for_update().get(pk=self.pk).balance)
+            deltas = {}
+            for index, new_transaction in enumerate(transactions):
+                new_transaction.account = self
+                amount = to_minor_units(new_transaction.amount) if new_transaction.active else 0
+                balance += amount
+                if amount < 0 and balance < 0:
+                    raise BatchAccountBalanceError(
+                        'Balance of account {} would be brought below 0'.format(self), index
+                    )
+                key = (self.pk, new_transaction.transaction_date)
+                deltas[key] = deltas.get(key, 0) + amount
+            created = Transaction.objects.bulk_create(transactions)
+            for new_transaction in created:
+                audit.record(
+                    Transaction, new_transaction.pk, 'create', None,
+                    audit.values(new_transaction, Transaction.AUDIT_FIELDS)
+                )
+            return created, Account.apply_balance_deltas(deltas)[self.pk]
+        created, self.balance = write_atomically(write)
+        return created
+
+    def balance_at_date(self, date):
+        """ Returns the balance at the close of date """
+        return DailyBalance.balance_at(self.pk, date)
+
+    @classmethod
+    def apply_balance_deltas(cls, deltas):
+        """ Adds the amounts in deltas ({(account pk, transaction date): cents})
+        to the stored balances and DailyBalance snapshots, and moves on the
+        version of every Account in deltas, even those with only zero amounts.
+        Must be called inside transaction.atomic().
+
+        Each balance is changed by a single conditional UPDATE, which only
+        applies a negative amount if the balance covers it, so the check and
+        the write can't be separated by a concurrent writer. The UPDATEs lock
+        the Account rows in primary key order, so concurrent writers queue up
+        rather than deadlock. AccountBalanceError is raised for an Account
+        that doesn't exist. Returns the new balances keyed by Account pk """
+        account_deltas = {}
+        for (account_id, _), delta in deltas.items():
+            account_deltas[account_id] = account_deltas.get(account_id, 0) + delta
+        for account_id in sorted(account_deltas):
+            delta = account_deltas[account_id]
+            query = cls.objects.filter(pk=account_id)
+            if delta < 0:
+                query = query.filter(balance__gte=from_minor_units(-delta))
+            if query.update(balance=add_minor_units('balance', delta), version=F('version') + 1):
+                continue
+            account = cls.objects.filter(pk=account_id).first()
+            if account is None:
+                raise AccountBalanceError('Account {} does not exist'.format(account_id))
+            raise AccountBalanceError(
+                'Balance of account {} would be brought below 0'.format(account)
+            )
+        balances = dict(cls.objects.filter(pk__in=account_deltas).values_list('pk', 'balance'))
+        DailyBalance.apply_deltas(deltas)
+        for account_id in {account_id for account_id, _ in deltas}:
+            balance_cache.invalidate(account_id)
+        return balances
 
 
 class Transaction(models.Model):
@@ -45,7 +254,7 @@ class Transaction(models.Model):
         Account, related_name='transactions',
         on_delete=models.PROTECT)
     transaction_date = models.DateField()
-    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    amount = MinorUnitDecimalField(max_digits=15, decimal_places=2)
     description = models.CharField(max_length=20, blank=True, default='')
 
     # If active is False, the transaction should not be visible to the
@@ -53,38 +262,374 @@ class Transaction(models.Model):
     active = models.BooleanField()
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
+    # Set on the legs of a JournalEntry
+    journal_entry = models.ForeignKey(
+        'JournalEntry', related_name='legs', null=True, blank=True, editable=False,
+        on_delete=models.PROTECT)
+
+    # What fintech.audit records of changes to a Transaction, by attribute name
+    AUDIT_FIELDS = (
+        'account_id', 'transaction_date', 'amount', 'description', 'active', 'journal_entry_id'
+    )
+
+    class Meta:
+        indexes = [
+            # Covers the active balance aggregates, in total or by date,
+            # without touching the table
+            models.Index(
+                fields=['account', 'active', 'transaction_date', 'amount'],
+                name='fintech_tx_balance_idx'
+            ),
+            # Matches the newest-first ordering of the transactions listing
+            models.Index(
+                fields=['account', '-create_time', '-transaction_date', '-uuid'],
+                name='fintech_tx_listing_idx'
+            ),
+            # Matches the ordering and date filter of the admin changelist
+            models.Index(
+                fields=['-transaction_date', '-create_time', '-uuid'],
+                name='fintech_tx_date_idx'
+            ),
+            # For admin searches on the description
+            models.Index(fields=['description'], name='fintech_tx_description_idx'),
+        ]
 
 
     def save(self, *args, **kwargs): #pylint: disable=W0221
-        """ Checks if a Transaction will bring the Account balance below 0 before save """
-        created = not self.uuid
-        if created:
-            existing_balance = self.account.calculated_balance
-        else:
-            all_other_active_transactions = [x for x in self.account.transactions.all() if x != self and x.active]
-            existing_balance = sum(x.amount for x in all_other_active_transactions)
-
-        if not self.active:
-            pass
-        elif (existing_balance + self.amount) < 0:
-            raise AccountBalanceError(
-                'Balance of account {} would be brought below 0'.format(self.account)
+        """ Applies the change in this Transaction's contribution to the Account
+        balance, refusing the save if it would bring the balance below 0 """
+        self._check_not_leg()
+        def write():
+            stored = self._stored_values()
+            deltas = self._reversing_deltas(stored)
+            key = (self.account_id, self.transaction_date)
+            deltas[key] = deltas.get(key, 0) + (to_minor_units(self.amount) if self.active else 0)
+            balances = Account.apply_balance_deltas(deltas)
+            instance = super(Transaction, self).save(*args, **kwargs)
+            audit.record(
+                Transaction, self.pk, 'create' if stored is None else 'update',
+                stored, audit.values(self, self.AUDIT_FIELDS)
             )
-
-        instance = super().save(*args, **kwargs)
-        self.account.update_balance()
+            return balances, instance
+        balances, instance = write_atomically(write)
+        self._refresh_account_balance(balances)
         return instance
 
 
-    def delete(self):
-        """ Checks if deleting a Transaction will bring the balance below 0 """
-        existing_balance = self.account.calculated_balance
+    def delete(self): #pylint: disable=W0221
+        """ Removes this Transaction's contribution from the Account balance,
+        refusing the delete if it would bring the balance below 0 """
+        self._check_not_leg()
+        def write():
+            stored = self._stored_values()
+            balances = Account.apply_balance_deltas(self._reversing_deltas(stored))
+            result = super(Transaction, self).delete()
+            audit.record(Transaction, self.pk, 'delete', stored, None)
+            return balances, result
+        balances, result = write_atomically(write)
+        self._refresh_account_balance(balances)
+        return result
 
-        if not self.active:
-            pass
-        elif (existing_balance - self.amount) < 0:
-            raise AccountBalanceError(
-                'Balance of account {} would be brought below 0'.format(self.account)
+
+    def _check_not_leg(self):
+        """ The legs of a JournalEntry only balance together, so can't be
+        changed one at a time """
+        if self.journal_entry_id is not None and not self._state.adding:
+            raise JournalEntryError(
+                'Transaction {} is a leg of journal entry {}, post a reversing entry '
+                'instead of changing it'.format(self.pk, self.journal_entry_id)
             )
 
-        super().delete()
+
+    def _stored_values(self):
+        """ The AUDIT_FIELDS of the stored copy of this Transaction, locked
+        for the rest of the database transaction, or None if there isn't one """
+        if self._state.adding:
+            return None
+        return Transaction.objects.select_for_update().filter(pk=self.pk).\
+            values(*self.AUDIT_FIELDS).first()
+
+
+    @staticmethod
+    def _reversing_deltas(stored):
+        """ Returns the deltas ({(account pk, transaction date): cents}) that
+        reverse what the stored values of a Transaction contribute to balances """
+        if stored is None:
+            return {}
+        return {
+            (stored['account_id'], stored['transaction_date']):
+            -to_minor_units(stored['amount']) if stored['active'] else 0
+        }
+
+
+    def _refresh_account_balance(self, balances):
+        """ Keeps an already loaded self.account in step with the stored balance """
+        if self.account_id in balances and Transaction.account.is_cached(self):
+            self.account.balance = balances[self.account_id]
+
+
+class JournalEntry(models.Model):
+    """
+    A double-entry posting, such as a transfer between Accounts: a set of
+    Transactions (its legs) whose amounts sum to 0. A negative leg debits
+    its Account, a positive one credits it.
+
+    The legs are ordinary active Transactions, so the Account invariants
+    cover them too. They are only ever written through post, which saves
+    every leg of a batch of entries, and their balance changes, at once or
+    not at all. Legs can't be changed or deleted one by one; post a
+    reversing entry instead.
+    """
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    transaction_date = models.DateField()
+    description = models.CharField(max_length=20, blank=True, default='')
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'journal entries'
+
+    @staticmethod
+    def _leg_deltas(index, legs):
+        """ The legs as (Account pk, cents), checking they balance """
+        if len(legs) < 2:
+            raise JournalEntryError('Journal entry {} has fewer than 2 legs'.format(index))
+        deltas = []
+        for account_id, amount in legs:
+            if not isinstance(amount, Decimal):
+                amount = Decimal(str(amount))
+            cents = to_minor_units(amount)
+            if not cents or from_minor_units(cents) != amount:
+                raise JournalEntryError(
+                    'Journal entry {} has a leg of {}, which is 0 or not in whole '
+                    'cents'.format(index, amount)
+                )
+            deltas.append((account_id, cents))
+        if sum(cents for _, cents in deltas):
+            raise JournalEntryError('The legs of journal entry {} do not sum to 0'.format(index))
+        return deltas
+
+    @classmethod
+    def post(cls, entries):
+        """ Saves entries, a list of (JournalEntry, legs) with legs a list of
+        (Account pk, amount), in one database transaction. Every entry must
+        balance, otherwise JournalEntryError is raised. The balances change
+        by the net amount of each Account's legs, each Account once, in the
+        lock order of Account.apply_balance_deltas. If the legs would bring a
+        balance below 0, AccountBalanceError is raised and nothing is saved.
+        Returns the legs as the Transactions created """
+        deltas = {}
+        leg_deltas = []
+        for index, (entry, legs) in enumerate(entries):
+            leg_deltas.append(cls._leg_deltas(index, legs))
+            for account_id, cents in leg_deltas[-1]:
+                key = (account_id, entry.transaction_date)
+                deltas[key] = deltas.get(key, 0) + cents
+
+        def write():
+            Account.apply_balance_deltas(deltas)
+            cls.objects.bulk_create([entry for entry, _ in entries])
+            legs = Transaction.objects.bulk_create([
+                Transaction(
+                    account_id=account_id, journal_entry=entry,
+                    transaction_date=entry.transaction_date, amount=from_minor_units(cents),
+                    description=entry.description, active=True,
+                )
+                for (entry, _), entry_deltas in zip(entries, leg_deltas)
+                for account_id, cents in entry_deltas
+            ])
+            for leg in legs:
+                audit.record(
+                    Transaction, leg.pk, 'create', None, audit.values(leg, Transaction.AUDIT_FIELDS)
+                )
+            return legs
+        return write_atomically(write)
+
+    @classmethod
+    def transfer(cls, from_account_id, to_account_id, amount, transaction_date, description=''):
+        """ Posts a JournalEntry moving amount from one Account to another.
+        Returns the JournalEntry """
+        if from_account_id == to_account_id:
+            raise JournalEntryError('Can not transfer from account {} to itself'.format(
+                from_account_id
+            ))
+        entry = cls(transaction_date=transaction_date, description=description)
+        cls.post([(entry, [(from_account_id, -amount), (to_account_id, amount)])])
+        return entry
+
+
+class DailyBalance(models.Model):
+    """
+    The balance of an Account at the close of a date: the sum of its active
+    Transactions with a transaction_date on or before that date.
+
+    There is a row for each date the Account has had active Transactions on,
+    so the balance at any date is that of the latest row on or before it.
+    Maintained by Account.apply_balance_deltas.
+    """
+    account = models.ForeignKey(
+        Account, related_name='daily_balances',
+        on_delete=models.CASCADE)
+    date = models.DateField()
+    balance = MinorUnitDecimalField(max_digits=15, decimal_places=2)
+
+    class Meta:
+        unique_together = ('account', 'date')
+
+    @classmethod
+    def balance_at(cls, account_id, date):
+        """ Returns the balance of the Account at the close of date """
+        balance = cls.objects.filter(account_id=account_id, date__lte=date).\
+            order_by('-date').values_list('balance', flat=True).first()
+        return 0 if balance is None else balance
+
+    @classmethod
+    def balances_at(cls, accounts, date):
+        """ balance_at for each Account in the accounts queryset, in one
+        query reading the latest snapshot of each. Keyed by Account pk """
+        latest = cls.objects.filter(account=OuterRef('pk'), date__lte=date).\
+            order_by('-date').values('balance')[:1]
+        return {
+            account_id: 0 if balance is None else balance
+            for account_id, balance in
+            accounts.annotate(balance_at=Subquery(latest)).values_list('pk', 'balance_at')
+        }
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """ Adds each amount in deltas ({(account pk, date): cents}) to the
+        snapshots from that date onwards, creating the snapshot for the date
+        itself if there isn't one yet """
+        for (account_id, date), delta in deltas.items():
+            if not delta:
+                continue
+            if not cls.objects.filter(account_id=account_id, date=date).exists():
+                cls.objects.create(
+                    account_id=account_id, date=date,
+                    balance=cls.balance_at(account_id, date)
+                )
+            cls.objects.filter(account_id=account_id, date__gte=date).update(
+                balance=add_minor_units('balance', delta)
+            )
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a POST on an Account made with an Idempotency-Key
+    header, so that a client retrying the POST with the same key gets the
+    same response rather than making the change twice.
+
+    request_hash fingerprints the request, so a key can't be reused for a
+    different one. Keys expire settings.IDEMPOTENCY_KEY_TTL_SECONDS after
+    create_time, and are removed by the purge_idempotency_keys command.
+    """
+    account = models.ForeignKey(
+        Account, related_name='idempotency_keys',
+        on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.TextField()
+    create_time = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('account', 'key')
+
+    @staticmethod
+    def expiry_cutoff():
+        """ Keys created before this have expired """
+        return timezone.now() - datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+
+
+class ApiToken(models.Model):
+    """
+    A key a User's API clients authenticate with, sent in an
+    'Authorization: Token <key>' header. A User can hold one per client,
+    each revoked on its own.
+
+    Only a SHA-256 hash of the key is stored. Keys are long and random, so
+    unlike passwords they need no slow hash to resist guessing.
+    key_prefix, the start of the key, tells tokens apart in the admin.
+    """
+    user = models.ForeignKey('auth.User', related_name='api_tokens', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100, help_text='Who or what the token was given to')
+    key_prefix = models.CharField(max_length=8, editable=False)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    create_time = models.DateTimeField(auto_now_add=True)
+    revoke_time = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def __str__(self):
+        return '{} ({}...)'.format(self.name, self.key_prefix)
+
+    @staticmethod
+    def hash_key(key):
+        """ What is stored of key """
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def create_token(cls, user, name):
+        """ Creates a token for user, returning it and its key. The key
+        can't be recovered later """
+        key = secrets.token_urlsafe(32)
+        token = cls.objects.create(
+            user=user, name=name, key_prefix=key[:8], key_hash=cls.hash_key(key)
+        )
+        return token, key
+
+    def revoke(self):
+        """ Stops the token working. Processes that have it cached in a
+        local-memory token cache go on accepting it for up to the cache's
+        TIMEOUT """
+        self.revoke_time = timezone.now()
+        ApiToken.objects.filter(pk=self.pk, revoke_time__isnull=True).update(
+            revoke_time=self.revoke_time
+        )
+        token_cache.invalidate([self.key_hash])
+
+
+class AuditEntryQuerySet(models.QuerySet):
+    """ Keeps bulk changes off the audit log """
+    def update(self, **kwargs):
+        raise ValueError('Audit entries can not be changed')
+
+    def delete(self):
+        raise ValueError('Audit entries can not be deleted')
+
+
+class AuditEntry(models.Model):
+    """
+    A change to an Account or Transaction: who made it, through what, and
+    the values before and after (JSON, null for creations and deletions).
+    Written in batches by fintech.audit. The log is append only: entries
+    can't be changed or deleted through the ORM.
+
+    user_id is not a foreign key, as entries outlive their users and are
+    written on a connection of their own.
+    """
+    time = models.DateTimeField(db_index=True)
+    source = models.CharField(max_length=100)
+    request = models.CharField(max_length=200, blank=True, default='')
+    user_id = models.IntegerField(null=True, blank=True)
+    username = models.CharField(max_length=150, blank=True, default='')
+    model = models.CharField(max_length=50)
+    object_id = models.CharField(max_length=64)
+    action = models.CharField(max_length=10)
+    before = models.TextField(null=True, blank=True)
+    after = models.TextField(null=True, blank=True)
+
+    objects = AuditEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = 'audit entries'
+        indexes = [
+            # The history of one object
+            models.Index(fields=['model', 'object_id', 'time'], name='fintech_audit_object_idx'),
+        ]
+
+    def save(self, *args, **kwargs): #pylint: disable=W0221
+        """ Only ever inserts """
+        if not self._state.adding:
+            raise ValueError('Audit entries can not be changed')
+        return super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs): #pylint: disable=W0221
+        raise ValueError('Audit entries can not be deleted')
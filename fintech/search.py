@@ -0,0 +1,20 @@
+""" Searches the fintech models can serve from their indexes """
+from django.db.models import Q
+
+
+def prefix_search(model, path, term):
+    """ A Q matching the values of path (a lookup path on model, such as
+    'account__name') that start with term, case sensitively. It uses range
+    comparisons, which an index on the field can serve, unlike the LIKE of
+    startswith, and follows relations through subqueries so each table's
+    indexes can be used """
+    name, _, rest = path.partition('__')
+    if rest:
+        related_model = model._meta.get_field(name).related_model
+        return Q(**{'{}__in'.format(name): related_model.objects.filter(
+            prefix_search(related_model, rest, term)
+        ).values('pk')})
+    conditions = {'{}__gte'.format(name): term}
+    if ord(term[-1]) < 0x10ffff:
+        conditions['{}__lt'.format(name)] = term[:-1] + chr(ord(term[-1]) + 1)
+    return Q(**conditions)
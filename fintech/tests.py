@@ -1,13 +1,41 @@
 """ Tests for fintech app """
 
 import datetime
+import functools
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
 from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 from django.core.management import call_command
-from django.test import TestCase
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum, Value
+from django.db.models.functions import Concat
+from django.db.models.signals import post_init
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.urls import reverse
 
-from .errors import AccountBalanceError
-from .models import Account, Transaction
+from . import audit, balance_cache
+from .connections import apply_sqlite_pragmas
+from .errors import AccountBalanceError, JournalEntryError
+from .fields import add_minor_units, from_minor_units, to_minor_units
+from .management.commands.benchmark_api import (
+    run_audit_benchmark, run_auth_benchmark, run_benchmarks, run_serializer_benchmarks
+)
+from .management.commands.populate_sample_data import populate_customers
+from .management.commands.stress_writes import run_stress, run_transfer_stress
+from .models import (
+    WRITE_ATTEMPTS, Account, AuditEntry, DailyBalance, JournalEntry, Transaction
+)
 
 
 class TestTransactionAmountProtection(TestCase):
@@ -104,9 +132,1057 @@ class TestTransactionAmountProtection(TestCase):
         transaction_2.save()
         transaction_1.delete()
 
+    def test_calculated_balance_ignores_inactive(self):
+        """ calculated_balance should sum active Transactions only, and be 0 when empty """
+        self.assertEqual(self.account.calculated_balance, 0)
+        for active in (True, False):
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=datetime.datetime.today().date(),
+                amount=Decimal('1.50'),
+                active=active,
+                description='Test transaction',
+            )
+        self.assertEqual(self.account.calculated_balance, Decimal('1.50'))
+
+    def test_transaction_save_cost_is_flat(self):
+        """ Saving a Transaction should not load the Account's history into Python """
+        loaded = []
+
+        def count_loaded(sender, instance, **kwargs): #pylint: disable=W0613
+            loaded.append(instance)
+
+        for _ in range(50):
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=datetime.datetime.today().date(),
+                amount=Decimal('1.00'),
+                active=True,
+                description='Test transaction',
+            )
+        transaction = Transaction(
+            account=self.account,
+            transaction_date=datetime.datetime.today().date(),
+            amount=Decimal('-1.00'),
+            active=True,
+            description='Test transaction',
+        )
+        post_init.connect(count_loaded, sender=Transaction)
+        try:
+            transaction.save()
+            transaction.delete()
+        finally:
+            post_init.disconnect(count_loaded, sender=Transaction)
+        self.assertEqual(loaded, [])
+        self.assertEqual(self.account.calculated_balance, Decimal('50.00'))
+
+    def test_transaction_changes_apply_deltas(self):
+        """ Editing, deactivating and deleting Transactions adjust the stored balance """
+        transaction = Transaction.objects.create(
+            account=self.account,
+            transaction_date=datetime.datetime.today().date(),
+            amount=Decimal('10.00'),
+            active=True,
+            description='Test transaction',
+        )
+        transaction.amount = Decimal('15.50')
+        transaction.save()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('15.50'))
+        transaction.active = False
+        transaction.save()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 0)
+        transaction.active = True
+        transaction.save()
+        transaction.delete()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 0)
+        self.assertEqual(self.account.balance, self.account.calculated_balance)
+
+    def test_transaction_moved_between_accounts(self):
+        """ Moving a Transaction to another Account moves its amount too """
+        other_account = Account.objects.create(
+            user=self.account.user, name='Other account', balance=0
+        )
+        transaction = Transaction.objects.create(
+            account=self.account,
+            transaction_date=datetime.datetime.today().date(),
+            amount=Decimal('10.00'),
+            active=True,
+            description='Test transaction',
+        )
+        transaction.account = other_account
+        transaction.save()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 0)
+        self.assertEqual(other_account.balance, Decimal('10.00'))
+
+    def test_transaction_save_updates_one_account(self):
+        """ A save should write its own Account row and nothing else """
+        Transaction.objects.create(
+            account=self.account,
+            transaction_date=datetime.datetime.today().date(),
+            amount=Decimal('10.00'),
+            active=True,
+            description='Test transaction',
+        )
+        with CaptureQueriesContext(connection) as context:
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=datetime.datetime.today().date(),
+                amount=Decimal('-5.00'),
+                active=True,
+                description='Test transaction',
+            )
+        account_updates = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "fintech_account"')
+        ]
+        self.assertEqual(len(account_updates), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('5.00'))
+
+    def test_account_version(self):
+        """ Every Transaction change moves the version on, and a stale save can't undo it """
+        stale_account = Account.objects.get(pk=self.account.pk)
+        transaction = Transaction.objects.create(
+            account=self.account,
+            transaction_date=datetime.datetime.today().date(),
+            amount=Decimal('10.00'),
+            active=True,
+            description='Test transaction',
+        )
+        transaction.description = 'Renamed'
+        transaction.save()
+        stale_account.name = 'Renamed account'
+        stale_account.save()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.version, 2)
+        self.assertEqual(self.account.name, 'Renamed account')
+        self.assertEqual(self.account.balance, Decimal('10.00'))
+        self.account.update_balance()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.version, 3)
+
+class TestMinorUnitStorage(TestCase):
+    """ Amounts are stored as integer cents but used as Decimals """
+    def setUp(self):
+        user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=user, name='Test account', balance=0)
+
+    def test_amounts_stored_as_cents(self):
+        """ The database holds integers, the model Decimals """
+        for _ in range(3):
+            Transaction.objects.create(
+                account=self.account, transaction_date=datetime.date(2018, 1, 1),
+                amount=Decimal('0.10'), active=True,
+            )
+        Transaction.objects.create(
+            account=self.account, transaction_date=datetime.date(2018, 1, 2),
+            amount=Decimal('-0.05'), active=True,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT amount FROM fintech_transaction ORDER BY amount')
+            self.assertEqual([row[0] for row in cursor.fetchall()], [-5, 10, 10, 10])
+            cursor.execute('SELECT balance FROM fintech_account')
+            self.assertEqual(cursor.fetchone()[0], 25)
+
+        self.account.refresh_from_db()
+        self.assertEqual(str(self.account.balance), '0.25')
+        self.assertEqual(str(self.account.calculated_balance), '0.25')
+        self.assertEqual(str(self.account.balance_at_date(datetime.date(2018, 1, 1))), '0.30')
+        self.assertEqual(
+            Transaction.objects.filter(amount__lt=Decimal('0.10')).get().amount, Decimal('-0.05')
+        )
+
+    def test_minor_units_rounding(self):
+        """ Amounts are rounded to cents as a DecimalField would """
+        self.assertEqual(to_minor_units(Decimal('1.005')), 100)
+        self.assertEqual(to_minor_units(Decimal('1.015')), 102)
+        self.assertEqual(to_minor_units('-12.34'), -1234)
+        self.assertEqual(str(from_minor_units(-1234)), '-12.34')
+        self.assertEqual(str(from_minor_units(0)), '0.00')
+
+
+class TestDailyBalance(TestCase):
+    """ Tests that the DailyBalance snapshots follow Transaction changes """
+    def setUp(self):
+        """ An account with a few days of history """
+        user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=user, name='Test account', balance=0)
+        self.today = datetime.datetime.today().date()
+        for days_ago in (10, 5, 5, 1):
+            Transaction.objects.create(
+                account=self.account,
+                transaction_date=self.today - datetime.timedelta(days=days_ago),
+                amount=Decimal('10.00'),
+                active=True,
+                description='Test transaction',
+            )
+
+    def assert_snapshots_match_history(self):
+        """ Compares balance_at_date with a sum over the transactions for each day """
+        for days_ago in range(12, -1, -1):
+            date = self.today - datetime.timedelta(days=days_ago)
+            expected = sum(
+                x.amount for x in self.account.transactions.all()
+                if x.active and x.transaction_date <= date
+            )
+            self.assertEqual(self.account.balance_at_date(date), expected)
+
+    def test_snapshots_created(self):
+        """ One snapshot per transaction date holding the closing balance """
+        snapshots = list(
+            self.account.daily_balances.order_by('date').values_list('balance', flat=True)
+        )
+        self.assertEqual(snapshots, [Decimal('10.00'), Decimal('30.00'), Decimal('40.00')])
+        self.assertEqual(self.account.balance_at_date(self.today - datetime.timedelta(days=11)), 0)
+        self.assert_snapshots_match_history()
+
+    def test_snapshots_follow_changes(self):
+        """ Backdated, edited, deactivated and deleted Transactions adjust later snapshots """
+        backdated = Transaction.objects.create(
+            account=self.account,
+            transaction_date=self.today - datetime.timedelta(days=7),
+            amount=Decimal('2.50'),
+            active=True,
+            description='Backdated',
+        )
+        self.assert_snapshots_match_history()
+        backdated.transaction_date = self.today - datetime.timedelta(days=3)
+        backdated.amount = Decimal('-4.00')
+        backdated.save()
+        self.assert_snapshots_match_history()
+        backdated.active = False
+        backdated.save()
+        self.assert_snapshots_match_history()
+        self.account.transactions.order_by('transaction_date').first().delete()
+        self.assert_snapshots_match_history()
+        self.assertEqual(
+            DailyBalance.balance_at(self.account.pk, self.today), self.account.calculated_balance
+        )
+
+class TestJournalEntry(TestCase):
+    """ Tests posting double-entry JournalEntries """
+    def setUp(self):
+        """ Three accounts with 10.00 in each """
+        user = User.objects.create_user(username='Test user')
+        self.today = datetime.datetime.today().date()
+        self.accounts = []
+        for i in range(3):
+            account = Account.objects.create(user=user, name='Account {}'.format(i), balance=0)
+            Transaction.objects.create(
+                account=account, transaction_date=self.today - datetime.timedelta(days=10),
+                amount=Decimal('10.00'), active=True,
+            )
+            self.accounts.append(account)
+        self.account_ids = [account.pk for account in self.accounts]
+
+    def assert_balances(self, *balances):
+        """ The accounts hold balances, and match their Transactions and snapshots """
+        for account, balance in zip(self.accounts, balances):
+            account.refresh_from_db()
+            self.assertEqual(account.balance, Decimal(balance))
+            self.assertEqual(account.calculated_balance, Decimal(balance))
+            self.assertEqual(account.balance_at_date(self.today), Decimal(balance))
+
+    def test_transfer(self):
+        """ A transfer debits one account and credits another """
+        versions = [Account.objects.get(pk=pk).version for pk in self.account_ids]
+        entry = JournalEntry.transfer(
+            self.account_ids[0], self.account_ids[1], Decimal('2.50'), self.today, 'Rent'
+        )
+        self.assert_balances('7.50', '12.50', '10.00')
+        legs = list(entry.legs.order_by('amount').values_list(
+            'account_id', 'amount', 'description', 'active'
+        ))
+        self.assertEqual(legs, [
+            (self.account_ids[0], Decimal('-2.50'), 'Rent', True),
+            (self.account_ids[1], Decimal('2.50'), 'Rent', True),
+        ])
+        self.assertEqual(
+            [account.version for account in self.accounts],
+            [versions[0] + 1, versions[1] + 1, versions[2]]
+        )
+
+    def test_overdraft_refused(self):
+        """ The debited account may not go below 0, and then nothing is saved """
+        with self.assertRaises(AccountBalanceError):
+            JournalEntry.transfer(self.account_ids[0], self.account_ids[1], 10.01, self.today)
+        self.assert_balances('10.00', '10.00', '10.00')
+        self.assertFalse(JournalEntry.objects.exists())
+        JournalEntry.transfer(self.account_ids[0], self.account_ids[1], 10, self.today)
+        self.assert_balances('0.00', '20.00', '10.00')
+
+    def test_missing_account_refused(self):
+        """ Legs on an Account that doesn't exist are refused, debit or credit """
+        missing_id = uuid.uuid4()
+        for from_account_id, to_account_id in [
+                (self.account_ids[0], missing_id), (missing_id, self.account_ids[0])
+        ]:
+            with self.assertRaisesMessage(AccountBalanceError, 'does not exist'):
+                JournalEntry.transfer(from_account_id, to_account_id, 1, self.today)
+        self.assert_balances('10.00', '10.00', '10.00')
+        self.assertFalse(JournalEntry.objects.exists())
+
+    def test_transfer_to_itself_refused(self):
+        """ A transfer needs two different accounts """
+        with self.assertRaises(JournalEntryError):
+            JournalEntry.transfer(self.account_ids[0], self.account_ids[0], 1, self.today)
+        self.assert_balances('10.00', '10.00', '10.00')
+        self.assertFalse(JournalEntry.objects.exists())
+
+    def test_multi_leg_batch(self):
+        """ Entries with several legs are posted together, netting per account """
+        entries = [
+            (JournalEntry(transaction_date=self.today, description='Split'), [
+                (self.account_ids[0], Decimal('-9.00')),
+                (self.account_ids[1], Decimal('4.00')),
+                (self.account_ids[2], Decimal('5.00')),
+            ]),
+            # Only covered by the first entry
+            (JournalEntry(transaction_date=self.today - datetime.timedelta(days=1)), [
+                (self.account_ids[2], Decimal('-15.00')),
+                (self.account_ids[0], Decimal('15.00')),
+            ]),
+        ]
+        with CaptureQueriesContext(connection) as context:
+            legs = JournalEntry.post(entries)
+        self.assertEqual(len(legs), 5)
+        self.assert_balances('16.00', '14.00', '0.00')
+        # Each Account's balance is updated once, in primary key order
+        updated = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "fintech_account"')
+        ]
+        self.assertEqual(len(updated), 3)
+        self.assertEqual(
+            [next(str(pk) for pk in self.account_ids if pk.hex in sql) for sql in updated],
+            sorted(str(pk) for pk in self.account_ids)
+        )
+
+    def test_unbalanced_refused(self):
+        """ Entries must have 2 or more legs of whole cents summing to 0 """
+        balanced = [(self.account_ids[2], Decimal('-1.00')), (self.account_ids[0], Decimal('1.00'))]
+        for legs in [
+                [(self.account_ids[0], Decimal('-1.00')), (self.account_ids[1], Decimal('0.99'))],
+                [(self.account_ids[0], Decimal('0'))] * 2,
+                [(self.account_ids[0], Decimal('-0.005')), (self.account_ids[1], Decimal('0.005'))],
+                [(self.account_ids[0], Decimal('1.00'))],
+        ]:
+            with self.assertRaises(JournalEntryError):
+                JournalEntry.post([
+                    (JournalEntry(transaction_date=self.today), balanced),
+                    (JournalEntry(transaction_date=self.today), legs),
+                ])
+        self.assertFalse(JournalEntry.objects.exists())
+        self.assert_balances('10.00', '10.00', '10.00')
+
+    def test_legs_unchangeable(self):
+        """ A leg can't be changed or deleted on its own """
+        entry = JournalEntry.transfer(self.account_ids[0], self.account_ids[1], 1, self.today)
+        leg = entry.legs.first()
+        leg.amount = Decimal('5.00')
+        with self.assertRaises(JournalEntryError):
+            leg.save()
+        with self.assertRaises(JournalEntryError):
+            leg.delete()
+        self.assert_balances('9.00', '11.00', '10.00')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite')
+class TestQueryPlans(TestCase):
+    """ Runs EXPLAIN QUERY PLAN on the queries of the hot paths in the API
+    and admin, so that dropping an index they rely on fails here """
+    # A step reading a whole fintech table rather than searching an index
+    FULL_SCAN = re.compile(r'\bSCAN (TABLE )?fintech_\w+$')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser(
+            username='Superuser', email='', password=None
+        )
+        populate_customers(range(3), {
+            'accounts_per_customer': 2,
+            'transactions_per_account': 50,
+            'chunk_size': 5000,
+            'seed': 'plans',
+        })
+        cls.account = Account.objects.first()
+        cls.today = datetime.datetime.today().date()
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def assert_uses_indexes(self, run, ordered=False, index=None):
+        """ Checks that no query made by run() scans a whole fintech table, if
+        ordered that none sorts its results rather than reading an index in
+        order, and that index is used by at least one of them """
+        with CaptureQueriesContext(connection) as context:
+            run()
+        queries = [
+            query['sql'] for query in context.captured_queries
+            if 'fintech_' in query['sql'] and not query['sql'].startswith('INSERT')
+        ]
+        self.assertTrue(queries)
+        steps = []
+        with connection.cursor() as cursor:
+            for sql in queries:
+                cursor.execute('EXPLAIN QUERY PLAN {}'.format(sql))
+                plan = [row[-1] for row in cursor.fetchall()]
+                message = '{}\n{}'.format(sql, '\n'.join(plan))
+                for step in plan:
+                    self.assertIsNone(self.FULL_SCAN.search(step), message)
+                    if ordered:
+                        self.assertNotIn('TEMP B-TREE', step, message)
+                steps.extend(plan)
+        if index:
+            self.assertTrue(any(index in step for step in steps), '\n'.join(steps))
+
+    def test_transactions_listing(self):
+        """ The listings filter and sort on fintech_tx_listing_idx """
+        url = reverse('account-transactions', args=(self.account.pk,))
+        for params in [{'page': 2}, {'pagination': 'cursor'}]:
+            self.assert_uses_indexes(functools.partial(self.client.get, url, params), ordered=True)
+
+    def test_transactions_listing_filters(self):
+        """ The filtered listings search indexes and still read them in order """
+        url = reverse('account-transactions', args=(self.account.pk,))
+        month_ago = self.today - datetime.timedelta(days=30)
+        for params in [
+                {'date_from': str(month_ago), 'date_to': str(self.today)},
+                {'amount_min': '-10.00', 'amount_max': '10.00', 'pagination': 'cursor'},
+                {'active': 'false'},
+                {'description': 'Sample Transaction 1'},
+        ]:
+            self.assert_uses_indexes(functools.partial(self.client.get, url, params), ordered=True)
+
+    def test_transactions_export(self):
+        """ The export is filtered by account and date """
+        url = reverse('account-export-transactions', args=(self.account.pk,))
+        self.assert_uses_indexes(lambda: b''.join(self.client.get(
+            url, {'date_from': str(self.today - datetime.timedelta(days=30))}
+        ).streaming_content))
+
+    def test_balances(self):
+        """ Current and historical balances, and the writes keeping them """
+        self.assert_uses_indexes(
+            lambda: self.account.calculated_balance, index='COVERING INDEX fintech_tx_balance_idx'
+        )
+        self.assert_uses_indexes(lambda: self.account.balance_at_date(self.today))
+        self.assert_uses_indexes(lambda: DailyBalance.balances_at(
+            Account.objects.filter(pk__in=[self.account.pk]), self.today
+        ), index='fintech_dailybalance_account_id_date')
+        self.assert_uses_indexes(lambda: Transaction.objects.create(
+            account=self.account, transaction_date=self.today - datetime.timedelta(days=100),
+            amount=Decimal('1.00'), active=True,
+        ).delete())
+
+    def test_admin(self):
+        """ The changelists, the Account page with its inline and searches """
+        changelist_url = reverse('admin:fintech_transaction_changelist')
+        self.assert_uses_indexes(
+            lambda: self.client.get(changelist_url), ordered=True, index='fintech_tx_date_idx'
+        )
+        self.assert_uses_indexes(lambda: self.client.get(
+            changelist_url, {'transaction_date__gte': str(self.today)}
+        ), ordered=True, index='fintech_tx_date_idx')
+        self.assert_uses_indexes(lambda: self.client.get(
+            reverse('admin:fintech_account_change', args=(self.account.pk,))
+        ))
+        self.assert_uses_indexes(lambda: self.client.get(
+            changelist_url, {'q': 'Sample Transaction 1'}
+        ), index='fintech_tx_description_idx')
+        self.assert_uses_indexes(lambda: self.client.get(
+            reverse('admin:fintech_account_changelist'), {'q': 'Sample Account'}
+        ), index='fintech_account_name')
+
+
+class TestAdmin(TestCase):
+    """ Tests the admin keeps to a bounded amount of work on big tables """
+    def setUp(self):
+        superuser = User.objects.create_superuser(username='Superuser', email='', password=None)
+        self.client.force_login(superuser)
+        populate_customers(range(2), {
+            'accounts_per_customer': 1,
+            'transactions_per_account': 80,
+            'chunk_size': 5000,
+            'seed': 'admin',
+        })
+        self.account = Account.objects.get(user__username='Sample User 0')
+        self.changelist_url = reverse('admin:fintech_transaction_changelist')
+
+    def test_transaction_changelist_queries(self):
+        """ The Accounts are loaded with the Transactions, not one by one """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.changelist_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 160)
+        self.assertLess(len(context.captured_queries), 10)
+
+    def test_estimated_count(self):
+        """ Big unfiltered changelists take their count from the statistics """
+        with mock.patch('fintech.admin.ESTIMATED_COUNT_THRESHOLD', 100), \
+                CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.changelist_url)
+            filtered_response = self.client.get(self.changelist_url, {'q': 'Sample Transaction 1'})
+        if connection.vendor == 'sqlite':
+            self.assertFalse(any(
+                'COUNT(*)' in query['sql'] and 'WHERE' not in query['sql']
+                for query in context.captured_queries
+            ))
+        self.assertGreaterEqual(response.context['cl'].result_count, 160)
+        # Sample Transaction 1 and 10 to 19 on each Account
+        self.assertEqual(filtered_response.context['cl'].result_count, 22)
+
+    def test_prefix_search(self):
+        """ Search terms match the start of the description, Account name or username """
+        def search(term):
+            response = self.client.get(self.changelist_url, {'q': term})
+            return response.context['cl'].result_count
+
+        # 7 and 70 to 79 on each Account
+        self.assertEqual(search('Sample Transaction 7'), 22)
+        self.assertEqual(search('Sample User 0'), 80)
+        self.assertEqual(search('Sample Account'), 160)
+        self.assertEqual(search('Transaction'), 0)
+        self.assertEqual(search('sample'), 0)
+        self.assertEqual(search(' Sample Transaction 79 '), 2)
+
+    def test_account_page_caps_inline(self):
+        """ The Account page shows only the latest Transactions, linking to the
+        rest without counting them """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('admin:fintech_account_change', args=(self.account.pk,))
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT COUNT(*)') and 'fintech_transaction' in query['sql']
+        ])
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(len(formset.forms), 50)
+        latest = self.account.transactions.order_by('-create_time', '-transaction_date')[:50]
+        self.assertEqual([form.instance.pk for form in formset.forms], [x.pk for x in latest])
+        self.assertContains(response, '?account__exact={}">All transactions'.format(
+            self.account.pk
+        ))
+        response = self.client.get(self.changelist_url, {'account__exact': self.account.pk})
+        self.assertEqual(response.context['cl'].result_count, 80)
+
+
+class TestBalanceCache(TestCase):
+    """ Tests the read-through balance cache and its invalidation """
+    def setUp(self):
+        user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=user, name='Test account', balance=0)
+        self.today = datetime.datetime.today().date()
+
+    def cached_balance(self, date=None):
+        """ Reads through the cache, noting whether it had to load """
+        self.loads = 0
+
+        def load():
+            self.loads += 1
+            if date:
+                return self.account.balance_at_date(date)
+            return Account.objects.get(pk=self.account.pk).balance
+        return balance_cache.get_or_load(self.account.pk, date, load)
+
+    def test_hits_and_invalidation(self):
+        """ Cached balances are served until a write changes them """
+        self.assertEqual(self.cached_balance(), 0)
+        self.assertEqual(self.loads, 1)
+        hits = balance_cache.stats()['hits']
+        self.assertEqual(self.cached_balance(), 0)
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(balance_cache.stats()['hits'], hits + 1)
+        self.assertEqual(self.cached_balance(self.today), 0)
+
+        transaction = Transaction.objects.create(
+            account=self.account,
+            transaction_date=self.today,
+            amount=Decimal('10.00'),
+            active=True,
+            description='Test transaction',
+        )
+        self.assertEqual(self.cached_balance(), Decimal('10.00'))
+        self.assertEqual(self.cached_balance(self.today), Decimal('10.00'))
+        transaction.delete()
+        self.assertEqual(self.cached_balance(), 0)
+        self.assertEqual(self.loads, 1)
+
+    def test_dummy_backend(self):
+        """ With the dummy backend, as settings_production uses without a
+        shared one, every read loads """
+        dummy = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+        with self.settings(CACHES=dict(settings.CACHES, balances=dummy)):
+            self.assertEqual(self.cached_balance(), 0)
+            Transaction.objects.create(
+                account=self.account, transaction_date=self.today, amount=Decimal('2.00'),
+                active=True,
+            )
+            self.assertEqual(self.cached_balance(), Decimal('2.00'))
+            self.assertEqual(self.cached_balance(), Decimal('2.00'))
+            # A cache would have served the second read
+            self.assertEqual(self.loads, 1)
+
+    def test_update_balance_invalidates(self):
+        """ Recalculating the balance drops the cached one """
+        self.cached_balance()
+        Account.objects.filter(pk=self.account.pk).update(balance=Decimal('3.00'))
+        self.assertEqual(self.cached_balance(), 0)
+        self.account.update_balance()
+        self.assertEqual(self.cached_balance(), 0)
+        self.assertEqual(self.loads, 1)
+
+    def test_delete_invalidates(self):
+        """ Deleting the Account drops its cached balances """
+        self.cached_balance()
+        Account.objects.get(pk=self.account.pk).delete()
+        # Rather than serving the cached balance, the read loads and finds no Account
+        with self.assertRaises(Account.DoesNotExist):
+            self.cached_balance()
+
 class TestPopulateSampleDataCommand(TestCase):
     def test_populate_sample_data_command(self):
-        call_command('populate_sample_data', number_customers=3, accounts_per_customer=3, transactions_per_account=3)
+        call_command(
+            'populate_sample_data', number_customers=3, accounts_per_customer=3,
+            transactions_per_account=3, verbosity=0,
+        )
         self.assertEqual(User.objects.count(), 3)
         self.assertEqual(Account.objects.count(), 9)
-        self.assertEqual(Transaction.objects.count(), 27)
\ No newline at end of file
+        self.assertEqual(Transaction.objects.count(), 27)
+
+    def test_populate_sample_data_at_volume(self):
+        """ Large, chunked runs keep balances consistent and are reproducible with a seed """
+        def generated_amounts(username_prefix):
+            return list(Transaction.objects.filter(
+                account__user__username__startswith=username_prefix
+            ).order_by(
+                'account__user__username', 'account__name', 'create_time'
+            ).values_list('amount', flat=True))
+
+        options = {
+            'number_customers': 2,
+            'accounts_per_customer': 2,
+            'transactions_per_account': 800,
+            'chunk_size': 500,
+            'seed': 'test',
+            'verbosity': 0,
+        }
+        call_command('populate_sample_data', **options)
+        self.assertEqual(Transaction.objects.count(), 3200)
+        today = datetime.datetime.today().date()
+        for account in Account.objects.all():
+            self.assertGreaterEqual(account.balance, 0)
+            self.assertEqual(account.balance, account.calculated_balance)
+            self.assertEqual(account.balance_at_date(today), account.balance)
+
+        User.objects.update(username=Concat(Value('First run '), 'username'))
+        call_command('populate_sample_data', **options)
+        self.assertEqual(generated_amounts('Sample'), generated_amounts('First run'))
+
+    def test_populate_sample_data_bounds_chunks(self):
+        """ One long history is written chunk_size Transactions at a time,
+        with a snapshot per day matching the Transactions """
+        chunks = []
+        bulk_create = Transaction.objects.bulk_create
+
+        def recording_bulk_create(objs, *args, **kwargs):
+            chunks.append(len(objs))
+            return bulk_create(objs, *args, **kwargs)
+        with mock.patch.object(Transaction.objects, 'bulk_create', recording_bulk_create):
+            call_command(
+                'populate_sample_data', number_customers=1, accounts_per_customer=1,
+                transactions_per_account=700, chunk_size=300, seed='chunks', verbosity=0,
+            )
+        self.assertEqual(chunks, [300, 300, 100])
+        account = Account.objects.get()
+        self.assertEqual(account.balance, account.calculated_balance)
+        snapshots = list(account.daily_balances.order_by('date'))
+        self.assertEqual(
+            len(snapshots), account.transactions.values('transaction_date').distinct().count()
+        )
+        for snapshot in snapshots:
+            self.assertEqual(snapshot.balance, account.transactions.filter(
+                transaction_date__lte=snapshot.date
+            ).aggregate(total=Sum('amount'))['total'])
+
+    def test_populate_sample_data_rejects_parallel_sqlite(self):
+        """ SQLite can't take writes from several processes at once """
+        with self.assertRaises(CommandError):
+            call_command('populate_sample_data', processes=2, verbosity=0)
+
+
+class TestReconcileBalancesCommand(TestCase):
+    """ Tests the reconcile_balances command """
+    def setUp(self):
+        call_command(
+            'populate_sample_data', number_customers=4, accounts_per_customer=2,
+            transactions_per_account=5, seed='reconcile', verbosity=0
+        )
+        self.account_ids = list(Account.objects.order_by('pk').values_list('pk', flat=True))
+        # Drift the balances of the second and last Accounts
+        self.drifted = [self.account_ids[1], self.account_ids[-1]]
+        Account.objects.filter(pk__in=self.drifted).update(balance=add_minor_units('balance', 123))
+
+    def reconcile(self, **options):
+        """ Runs the command, returning what it wrote and whether it failed """
+        out = StringIO()
+        try:
+            call_command('reconcile_balances', chunk_size=3, stdout=out, **options)
+        except CommandError:
+            return out.getvalue(), True
+        return out.getvalue(), False
+
+    def test_reports_drift(self):
+        """ Drifted accounts are listed, and the command fails """
+        with CaptureQueriesContext(connection) as context:
+            out, failed = self.reconcile()
+        # Listing the accounts and one grouped query for each chunk of 3
+        self.assertEqual(len(context.captured_queries), 3 * 2 + 1)
+        self.assertTrue(failed)
+        self.assertIn('8 accounts checked, 2 failed, 0 repaired', out)
+        for account_id in self.drifted:
+            self.assertIn('Account {}: balance'.format(account_id), out)
+        self.assertEqual(out.count('Account '), 2)
+
+    def test_repair(self):
+        """ --repair sets the balances to the sum of their Transactions """
+        versions = dict(Account.objects.values_list('pk', 'version'))
+        out, failed = self.reconcile(repair=True)
+        self.assertFalse(failed)
+        self.assertIn('8 accounts checked, 2 failed, 2 repaired', out)
+        for account in Account.objects.all():
+            self.assertEqual(account.balance, account.calculated_balance)
+            self.assertEqual(
+                account.version, versions[account.pk] + (account.pk in self.drifted)
+            )
+        out, failed = self.reconcile()
+        self.assertFalse(failed)
+        self.assertIn('0 failed', out)
+
+    def test_negative_balance_not_repaired(self):
+        """ A balance can't be repaired to below 0 """
+        account = Account.objects.get(pk=self.drifted[0])
+        Transaction.objects.filter(account=account).update(amount=Decimal('-1.00'))
+        out, failed = self.reconcile(repair=True)
+        self.assertTrue(failed)
+        self.assertIn('2 failed, 1 repaired', out)
+        self.assertNotEqual(Account.objects.get(pk=account.pk).balance, Decimal('-5.00'))
+
+    def test_resume_from_checkpoint(self):
+        """ A checkpoint skips the accounts already checked and is removed at the end """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            with open(path, 'w') as checkpoint_file:
+                json.dump({
+                    'after': str(self.account_ids[2]), 'checked': 3, 'failed': 1, 'repaired': 0
+                }, checkpoint_file)
+            out, failed = self.reconcile(checkpoint=path, repair=True)
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(failed)
+        self.assertIn('8 accounts checked, 2 failed, 1 repaired', out)
+        self.assertNotIn(str(self.drifted[0]), out)
+        self.assertIn('Account {}: balance'.format(self.drifted[1]), out)
+
+    def test_rejects_parallel_sqlite_repair(self):
+        """ SQLite can't take writes from several processes at once """
+        if connection.vendor == 'sqlite':
+            with self.assertRaises(CommandError):
+                call_command('reconcile_balances', processes=2, repair=True)
+
+
+class TestConcurrentWrites(TransactionTestCase):
+    """ Transactions saved from several threads at once, each with its own
+    database connection, so the test data has to be committed. On SQLite
+    the class runs on a database file of its own, shared by its tests and
+    emptied after each one, as threads sharing the in-memory test database
+    get its table locks rather than the locking of SQLite on disk """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_database = None
+        if connection.vendor != 'sqlite':
+            return
+        # The audit writer connects to whichever database it first writes to
+        audit.stop()
+        cls.test_database = connections['default']
+        cls.directory = tempfile.mkdtemp()
+        settings_dict = dict(
+            connections.databases['default'],
+            NAME=os.path.join(cls.directory, 'concurrent.sqlite3'),
+        )
+        # New threads connect with these settings, the test database
+        # connection is kept so the in-memory database survives
+        connections.databases['default'] = settings_dict
+        connections['default'] = cls.test_database.__class__(settings_dict, 'default')
+        call_command('migrate', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        # The audit writer mustn't be left writing to the file
+        audit.stop()
+        connection.close()
+        if cls.test_database is not None:
+            connections.databases['default'] = cls.test_database.settings_dict
+            connections['default'] = cls.test_database
+            shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def tearDown(self):
+        connection.close()
+
+    def assert_invariants_hold(self, result):
+        """ No update was lost and no balance went below 0 """
+        self.assertEqual(result['saved'] + result['refused'], result['writes'])
+        self.assertEqual(result['missing'], 0)
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(result['failed_snapshots'], [])
+
+    def test_same_account(self):
+        """ Writers contending for one Account queue up, and withdrawals it
+        can't cover are refused """
+        result = run_stress(workers=6, writes=20, same_account=True)
+        self.assert_invariants_hold(result)
+        self.assertGreater(result['refused'], 0)
+
+    def test_cross_account(self):
+        """ Writers on different Accounts don't get in each other's way """
+        self.assert_invariants_hold(run_stress(workers=6, writes=20, same_account=False))
+
+    def test_transfers(self):
+        """ Transfers crossing in opposite directions neither deadlock nor
+        make or lose money """
+        result = run_transfer_stress(workers=6, writes=15, accounts=3)
+        self.assert_invariants_hold(result)
+        self.assertEqual(result['unbalanced'], 0)
+        self.assertEqual(result['money_made'], 0)
+
+    def save_colliding(self, error, collisions):
+        """ Saves a Transaction whose first collisions attempts fail with
+        error, recording the attempts in self.attempts. Returns their number """
+        account = Account.objects.create(
+            user=User.objects.create(username='Collider'), name='Collider', balance=0
+        )
+        self.attempts = []
+        apply_balance_deltas = Account.apply_balance_deltas
+
+        def collide(deltas):
+            self.attempts.append(deltas)
+            if len(self.attempts) <= collisions:
+                raise OperationalError(error)
+            return apply_balance_deltas(deltas)
+        with mock.patch('fintech.models.time.sleep'), \
+                mock.patch.object(Account, 'apply_balance_deltas', side_effect=collide):
+            try:
+                Transaction.objects.create(
+                    account=account, transaction_date=datetime.date(2018, 1, 1),
+                    amount=Decimal('5.00'), active=True
+                )
+            finally:
+                self.assertEqual(
+                    Account.objects.get(pk=account.pk).balance, account.calculated_balance
+                )
+        return len(self.attempts)
+
+    def test_conflicts_retried(self):
+        """ A save that collides with another writer is rolled back and tried again """
+        self.assertEqual(self.save_colliding('database is locked', 2), 3)
+        self.assertEqual(Transaction.objects.get().amount, Decimal('5.00'))
+
+    def test_retries_bounded(self):
+        """ A save that keeps colliding gives up after WRITE_ATTEMPTS """
+        with self.assertRaises(OperationalError):
+            self.save_colliding('database table is locked', 100)
+        self.assertEqual(len(self.attempts), WRITE_ATTEMPTS)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_other_errors_not_retried(self):
+        """ Only collisions with other writers are worth another try """
+        with self.assertRaises(OperationalError):
+            self.save_colliding('disk I/O error', 1)
+        self.assertEqual(len(self.attempts), 1)
+
+    def test_not_retried_in_outer_transaction(self):
+        """ Only the outer transaction as a whole could be tried again """
+        with self.assertRaises(OperationalError), transaction.atomic():
+            self.save_colliding('database is locked', 1)
+        self.assertEqual(len(self.attempts), 1)
+
+
+class TestAuditLog(TransactionTestCase):
+    """ Changes are only queued for the audit log once committed, so the
+    test data has to be committed """
+    def setUp(self):
+        # Entries left over from other tests are written before their tables are emptied
+        audit.flush()
+        self.superuser = User.objects.create_superuser(
+            username='Auditor', email='', password=None
+        )
+        self.client.force_login(self.superuser)
+        self.account = Account.objects.create(user=self.superuser, name='Audited', balance=0)
+        self.transaction = Transaction.objects.create(
+            account=self.account, transaction_date=datetime.date(2018, 11, 1),
+            amount=Decimal('1.00'), active=True,
+        )
+        # So that the writer isn't holding SQLite's lock when a test writes
+        audit.flush()
+
+    def tearDown(self):
+        audit.flush()
+        connection.close()
+
+    @staticmethod
+    def entries(instance):
+        """ The audit log of instance, oldest first """
+        audit.flush()
+        return list(AuditEntry.objects.filter(
+            model=instance._meta.label, object_id=str(instance.pk)
+        ).order_by('time', 'pk'))
+
+    def test_api_changes(self):
+        """ Changes through the API are put down to the user and the request """
+        url = reverse('account-transactions', args=(self.account.uuid,))
+        response = self.client.post(url, {
+            'transaction_date': '2018-11-02', 'amount': '-0.25', 'description': 'Audited',
+        })
+        self.assertEqual(response.status_code, 201)
+        created = Transaction.objects.get(description='Audited')
+        [entry] = self.entries(created)
+        self.assertEqual(
+            (entry.source, entry.request, entry.user_id, entry.username, entry.action),
+            ('api', 'POST {}'.format(url), self.superuser.pk, 'Auditor', 'create')
+        )
+        self.assertIsNone(entry.before)
+        self.assertEqual(json.loads(entry.after), {
+            'account_id': str(self.account.pk), 'transaction_date': '2018-11-02',
+            'amount': '-0.25', 'description': 'Audited', 'active': True,
+            'journal_entry_id': None,
+        })
+
+    def test_admin_changes(self):
+        """ Changes through the admin have the values before and after """
+        response = self.client.post(
+            reverse('admin:fintech_transaction_change', args=(self.transaction.pk,)), {
+                'account': self.account.pk, 'transaction_date': '2018-11-01',
+                'amount': '2.00', 'description': 'Changed', 'active': 'on',
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        entry = self.entries(self.transaction)[-1]
+        self.assertEqual(
+            (entry.source, entry.username, entry.action), ('admin', 'Auditor', 'update')
+        )
+        before, after = json.loads(entry.before), json.loads(entry.after)
+        self.assertEqual((before['amount'], before['description']), ('1.00', ''))
+        self.assertEqual((after['amount'], after['description']), ('2.00', 'Changed'))
+
+    def test_context_and_repairs(self):
+        """ Deletions and balance repairs are recorded, under the given context """
+        with audit.context('reconcile', user=self.superuser):
+            Account.objects.filter(pk=self.account.pk).update(balance=Decimal('5.00'))
+            self.account.update_balance()
+            self.transaction.delete()
+        repair = self.entries(self.account)[-1]
+        self.assertEqual((repair.source, repair.user_id, repair.action), (
+            'reconcile', self.superuser.pk, 'repair'
+        ))
+        self.assertEqual(
+            (json.loads(repair.before), json.loads(repair.after)),
+            ({'balance': '5.00'}, {'balance': '1.00'})
+        )
+        deletion = self.entries(self.transaction)[-1]
+        self.assertEqual((deletion.action, deletion.after), ('delete', None))
+        self.assertEqual(json.loads(deletion.before)['amount'], '1.00')
+
+    def test_rolled_back_changes_not_recorded(self):
+        """ Only committed changes are recorded """
+        with self.assertRaises(AccountBalanceError), transaction.atomic():
+            self.transaction.description = 'Rolled back'
+            self.transaction.save()
+            Transaction.objects.create(
+                account=self.account, transaction_date=datetime.date(2018, 11, 1),
+                amount=Decimal('-5.00'), active=True,
+            )
+        self.assertEqual([entry.action for entry in self.entries(self.transaction)], ['create'])
+        with override_settings(AUDIT_LOG_ENABLED=False):
+            self.transaction.save()
+        self.assertEqual(len(self.entries(self.transaction)), 1)
+
+    def test_append_only(self):
+        """ Entries can't be changed or deleted """
+        entry = self.entries(self.account)[0]
+        entry.action = 'changed'
+        for change in (entry.save, entry.delete, AuditEntry.objects.all().delete,
+                       functools.partial(AuditEntry.objects.update, action='changed')):
+            with self.assertRaises(ValueError):
+                change()
+        self.assertEqual(self.entries(self.account)[0].action, 'create')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Pragmas are SQLite only')
+class TestSqlitePragmas(TestCase):
+    """ Tests settings.SQLITE_PRAGMAS are run on new connections """
+    def pragma(self, name, **settings):
+        """ The value of the pragma on a new connection opened with settings """
+        new_connection = connection.copy()
+        try:
+            with self.settings(**settings), new_connection.cursor() as cursor:
+                cursor.execute('PRAGMA {}'.format(name))
+                return cursor.fetchone()[0]
+        finally:
+            new_connection.close()
+
+    def test_pragmas_applied(self):
+        """ Each new connection gets the pragmas, which are checked """
+        self.assertEqual(self.pragma('synchronous', SQLITE_PRAGMAS={}), 2)
+        self.assertEqual(self.pragma('synchronous', SQLITE_PRAGMAS={'synchronous': 'NORMAL'}), 1)
+        self.assertEqual(self.pragma('cache_size', SQLITE_PRAGMAS={'cache_size': -4000}), -4000)
+        with self.assertRaises(ImproperlyConfigured), \
+                self.settings(SQLITE_PRAGMAS={'synchronous': 'OFF; DROP TABLE fintech_account'}):
+            apply_sqlite_pragmas(None, connection)
+
+
+class TestBenchmarkApi(TestCase):
+    def test_run_benchmarks(self):
+        """ Every endpoint is measured, and query counts don't grow with history """
+        results = run_benchmarks([5, 60], requests=3)
+        self.assertEqual(len(results), 12)
+        by_size = {}
+        for result in results:
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            by_size.setdefault(result['history_size'], {})[result['endpoint']] = result
+        for endpoint, result in by_size[5].items():
+            self.assertEqual(by_size[60][endpoint]['queries'], result['queries'], endpoint)
+        self.assertLessEqual(by_size[60]['transactions_first_page']['rows_fetched'], 20)
+
+    def test_run_serializer_benchmarks(self):
+        """ Both serialisers are measured and render the same history """
+        run_benchmarks([30], requests=1)
+        results = run_serializer_benchmarks([30], repeats=2)
+        self.assertEqual(
+            [result['serializer'] for result in results], ['model_serializer', 'row_serializer']
+        )
+        self.assertEqual(results[0]['response_bytes'], results[1]['response_bytes'])
+        self.assertTrue(all(result['rows_per_sec'] > 0 for result in results))
+
+    def test_run_audit_benchmark(self):
+        """ Recording a change takes well under a millisecond """
+        result = run_audit_benchmark(requests=5)
+        self.assertLess(result['record_ms'], 1)
+        self.assertGreater(result['off_p50_ms'], 0)
+        self.assertGreater(result['on_p50_ms'], 0)
+
+    def test_run_auth_benchmark(self):
+        """ A cached token costs no queries on the auth tables, unlike basic authentication """
+        results = run_auth_benchmark(requests=1)
+        self.assertEqual(len(results), 4)
+        for result in results:
+            if result['auth'] == 'token':
+                self.assertEqual(result['auth_queries'], 0, result['endpoint'])
+            else:
+                self.assertGreater(result['auth_queries'], 0, result['endpoint'])
@@ -0,0 +1,122 @@
+""" Read-through cache of API tokens and the Users they authenticate
+
+Entries live in the Django cache named by settings.TOKEN_CACHE_ALIAS
+(defaulting to 'default'), keyed by the hash of the token. Each holds the
+ApiToken together with its User, whose permissions are loaded, so a
+request with a cached token makes no queries to authenticate or to check
+permissions. Revoking or deleting a token drops its entry. So does any
+change to its User, their groups or the permissions of those groups.
+
+The local-memory backend of the default settings is an LRU cache per
+process, and invalidate() only reaches the process it runs in. Other
+processes notice within the cache's TIMEOUT, unless the alias points at a
+shared backend.
+"""
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _cache():
+    return caches[getattr(settings, 'TOKEN_CACHE_ALIAS', 'default')]
+
+
+def _key(key_hash):
+    return 'fintech:token:{}'.format(key_hash)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_or_load(key_hash, load):
+    """ Returns the cached ApiToken with key_hash. On a miss it is taken from
+    load() and stored, unless load() returns None for no such live token """
+    cache = _cache()
+    token = cache.get(_key(key_hash))
+    if token is not None:
+        _count('hits')
+        return token
+    _count('misses')
+    token = load()
+    if token is not None:
+        cache.set(_key(key_hash), token)
+    return token
+
+
+def invalidate(key_hashes):
+    """ Drops the cached tokens with key_hashes, both now and once the
+    current database transaction commits, so that nothing read in between
+    survives the commit """
+    keys = [_key(key_hash) for key_hash in key_hashes]
+    if not keys:
+        return
+
+    def drop():
+        _cache().delete_many(keys)
+    _count('invalidations')
+    drop()
+    transaction.on_commit(drop)
+
+
+def invalidate_users(user_ids):
+    """ Drops the cached tokens of the Users with user_ids """
+    from .models import ApiToken
+    invalidate(ApiToken.objects.filter(user_id__in=list(user_ids)).values_list(
+        'key_hash', flat=True
+    ))
+
+
+def stats():
+    """ Hit, miss and invalidation counters since the process started """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def token_deleted(sender, instance, **kwargs): #pylint: disable=W0613
+    """ post_delete receiver for ApiToken """
+    invalidate([instance.key_hash])
+
+
+def user_changed(sender, instance, **kwargs): #pylint: disable=W0613
+    """ post_save and post_delete receiver for User, as a cached User might
+    have been deactivated or lost superuser status """
+    invalidate_users([instance.pk])
+
+
+def user_permissions_changed(sender, instance, action, reverse, pk_set, #pylint: disable=W0613
+                             **kwargs):
+    """ m2m_changed receiver for User.groups and User.user_permissions.
+    Clears are handled before they happen, while the Users are still known """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_users([instance.pk])
+    elif pk_set is not None:
+        invalidate_users(pk_set)
+    else:
+        # A Group or Permission cleared of all its Users
+        invalidate_users(sender.objects.filter(**{
+            '{}_id'.format(instance._meta.model_name): instance.pk
+        }).values_list('user_id', flat=True))
+
+
+def group_permissions_changed(sender, instance, action, reverse, pk_set, #pylint: disable=W0613
+                              **kwargs):
+    """ m2m_changed receiver for Group.permissions, dropping the tokens of
+    the Users in the Groups changed """
+    from django.contrib.auth.models import User
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        groups = [instance.pk]
+    elif pk_set is not None:
+        groups = pk_set
+    else:
+        groups = sender.objects.filter(permission_id=instance.pk).values_list('group_id', flat=True)
+    invalidate_users(User.objects.filter(groups__in=list(groups)).values_list('pk', flat=True))